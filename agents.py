@@ -0,0 +1,283 @@
+import abc
+import time
+import numpy as np
+from neighbours import NeighbourIndex
+
+SIDES = (-1, 0, 1)  # rows of the perception arrays: left, own, right lane
+
+
+class Perception:
+    """
+    Leader and follower of every fleet vehicle in its own lane and the
+    two adjacent ones, found for all vehicles at once with a
+    NeighbourIndex. Other cars of the simulator count as obstacles. On
+    loops the search wraps around. Gaps are bumper to bumper from the
+    lengths of both vehicles, inf when a lane is empty and -inf when it
+    does not exist, speeds are 0 without a neighbour.
+
+    lead_gap, lead_v, follow_gap, follow_v are (3, N) arrays, one row per
+    entry of SIDES.
+    """
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.index = NeighbourIndex(fleet.route)
+        n = len(fleet)
+        self.lead_gap = np.full((3, n), np.inf)
+        self.lead_v = np.zeros((3, n))
+        self.follow_gap = np.full((3, n), np.inf)
+        self.follow_v = np.zeros((3, n))
+
+    def update(self, sim):
+        fleet = self.fleet
+        route = fleet.route
+        n = len(fleet)
+        cars = [car for car in sim.cars if hasattr(car, 'route')]
+        s = np.concatenate([fleet.s, [c.s for c in cars]])
+        lane = np.concatenate([fleet.lane, [c.lane for c in cars]])
+        v = np.concatenate([fleet.v, [c.v for c in cars]])
+        length = np.concatenate([np.full(n, float(fleet.length)),
+                                 [c.length for c in cars]])
+        self.index.update(s, lane)
+
+        query = fleet.lane + np.array(SIDES)[:, None]
+        invalid = (query < 0) | (query >= route.lane_num)
+        own = np.arange(n)
+        for gaps, speeds, nearest in (
+                (self.lead_gap, self.lead_v, self.index.lead),
+                (self.follow_gap, self.follow_v, self.index.follower)):
+            other, ds = nearest(fleet.s, query, exclude=own)
+            # other is -1 without a neighbour, ds is then inf
+            found = other >= 0
+            np.subtract(ds, (fleet.length +
+                             np.where(found, length[other], 0.)) / 2.,
+                        out=gaps)
+            gaps[invalid] = -np.inf
+            speeds[:] = np.where(found, v[other], 0.)
+
+
+class Policy(abc.ABC):
+    """
+    A behaviour shared by many agents. update sets the commands of the
+    fleet rows idx from the latest perception in one vectorized call.
+    rate is the update frequency in Hz, None for every tick.
+    """
+    rate = None
+
+    @abc.abstractmethod
+    def update(self, agents, idx):
+        pass
+
+
+class LaneKeeping(Policy):
+    """
+    Stays in lane and drives toward the desired speed, braking at
+    max_dec whenever the leader is closer than time_gap seconds.
+    """
+
+    def __init__(self, gain=0.5, max_acc=2., max_dec=4., time_gap=1.,
+                 rate=5.):
+        self.gain = gain
+        self.max_acc = max_acc
+        self.max_dec = max_dec
+        self.time_gap = time_gap
+        self.rate = rate
+
+    def update(self, agents, idx):
+        v = agents.fleet.v[idx]
+        acc = np.clip(self.gain * (agents.desired_v[idx] - v),
+                      -self.max_dec, self.max_acc)
+        close = agents.perception.lead_gap[1, idx] < v * self.time_gap
+        acc[close] = -self.max_dec
+        agents.acc[idx] = acc
+
+
+class IDM(Policy):
+    """
+    Intelligent Driver Model car following in the current lane.
+    """
+
+    def __init__(self, time_gap=1.5, min_gap=2., max_acc=1.5,
+                 comfort_dec=2., delta=4, max_dec=9., rate=5.):
+        self.time_gap = time_gap
+        self.min_gap = min_gap
+        self.max_acc = max_acc
+        self.comfort_dec = comfort_dec
+        self.delta = delta
+        self.max_dec = max_dec
+        self.rate = rate
+
+    def acceleration(self, v, desired_v, gap, lead_v):
+        """
+        IDM acceleration for arrays of speed, desired speed and the gap
+        to and speed of the leader (inf gap for a free road).
+        """
+        desired_gap = self.min_gap + np.maximum(
+            v * self.time_gap + v * (v - lead_v) /
+            (2 * np.sqrt(self.max_acc * self.comfort_dec)), 0)
+        acc = self.max_acc * (
+            1 - (v / np.maximum(desired_v, 0.1))**self.delta -
+            (desired_gap / np.maximum(gap, 0.1))**2)
+        return np.maximum(acc, -self.max_dec)
+
+    def update(self, agents, idx):
+        perception = agents.perception
+        agents.acc[idx] = self.acceleration(
+            agents.fleet.v[idx], agents.desired_v[idx],
+            perception.lead_gap[1, idx], perception.lead_v[1, idx])
+
+
+class LaneChange(Policy):
+    """
+    MOBIL style lane changes on top of an IDM model: an agent moves to an
+    adjacent lane when its IDM acceleration there beats the current one
+    by threshold, counting politeness times the deceleration imposed on
+    the new follower, and that follower does not have to brake harder
+    than safe_dec. Agents still gliding to their lane do not decide.
+    Only the lane is changed, pair it with a car following policy.
+    """
+
+    def __init__(self, idm=None, politeness=0.3, threshold=0.2,
+                 safe_dec=4., rate=1.):
+        self.idm = idm or IDM()
+        self.politeness = politeness
+        self.threshold = threshold
+        self.safe_dec = safe_dec
+        self.rate = rate
+
+    def update(self, agents, idx):
+        fleet = agents.fleet
+        perception = agents.perception
+        acceleration = self.idm.acceleration
+        idx = idx[np.abs(fleet.d[idx] -
+                         fleet.route.to_d_many(fleet.lane[idx])) < 0.1]
+        v, desired_v = fleet.v[idx], agents.desired_v[idx]
+        current = acceleration(v, desired_v, perception.lead_gap[1, idx],
+                               perception.lead_v[1, idx])
+        best_gain = np.full(len(idx), self.threshold)
+        best_side = np.zeros(len(idx), dtype=np.int64)
+        for row in (0, 2):
+            lead_gap = perception.lead_gap[row, idx]
+            follow_gap = perception.follow_gap[row, idx]
+            follow_v = perception.follow_v[row, idx]
+            mine = acceleration(v, desired_v, lead_gap,
+                                perception.lead_v[row, idx])
+            # the new follower would have this agent as its leader
+            imposed = acceleration(follow_v, follow_v, follow_gap, v)
+            gain = mine - current + self.politeness * np.minimum(imposed, 0)
+            ok = (lead_gap > 0) & (follow_gap > 0) & \
+                (imposed > -self.safe_dec) & (gain > best_gain)
+            best_gain[ok] = gain[ok]
+            best_side[ok] = SIDES[row]
+        change = best_side != 0
+        fleet.lane[idx[change]] += best_side[change]
+        agents.lane_changes += int(change.sum())
+
+
+class Agents:
+    """
+    Behaviour layer for the rows of a Fleet. Each policy drives the rows
+    assigned to it in one vectorized update at its own rate, perception
+    runs at perception_rate, and every tick the commanded acceleration is
+    integrated into v while d glides toward the lane center at
+    lateral_speed. attach registers all of it as Simulator callbacks.
+    Add every vehicle to the fleet before creating its Agents.
+    """
+
+    def __init__(self, fleet, perception_rate=10., lateral_speed=1.):
+        self.fleet = fleet
+        self.perception_rate = perception_rate
+        self.lateral_speed = lateral_speed
+        self.perception = Perception(fleet)
+        self.policies = []
+        self.rows = []
+        self.desired_v = fleet.v.copy()
+        self.acc = np.zeros(len(fleet))
+        self.lane_changes = 0
+
+    def add(self, policy, idx, desired_v=None):
+        """
+        Assigns fleet rows to a policy, rows added to a policy twice are
+        batched into its one update.
+        """
+        idx = np.atleast_1d(np.arange(len(self.fleet))[idx])
+        if desired_v is not None:
+            self.desired_v[idx] = desired_v
+        for i, known in enumerate(self.policies):
+            if known is policy:
+                self.rows[i] = np.union1d(self.rows[i], idx)
+                return policy
+        self.policies.append(policy)
+        self.rows.append(idx)
+        return policy
+
+    def attach(self, sim):
+        sim.add_callback(self.perception.update, self.perception_rate)
+        for policy, idx in zip(self.policies, self.rows):
+            sim.add_callback(self._updater(policy, idx), policy.rate)
+        sim.add_callback(self.step)
+
+    def _updater(self, policy, idx):
+        def update(sim):
+            policy.update(self, idx)
+        return update
+
+    def step(self, sim):
+        fleet = self.fleet
+        np.maximum(fleet.v + self.acc * sim.dt, 0, out=fleet.v)
+        offset = fleet.route.to_d_many(fleet.lane) - fleet.d
+        fleet.d += np.clip(offset, -self.lateral_speed * sim.dt,
+                           self.lateral_speed * sim.dt)
+
+
+def main():
+    from fleet import Fleet
+    from map import Route
+    from simulator import Simulator
+    print("Test Agents class")
+    route = Route()
+    route.read("highway_map.csv")
+    rng = np.random.RandomState(0)
+    n = 300
+    sim = Simulator(route)
+    sim.add_car(s=0, lane=1, v=20)
+    fleet = sim.add_fleet(Fleet(route, n))
+    fleet.v[:] = rng.uniform(15, 25, n)
+    fleet.move_to_route(np.sort(rng.choice(int(route.length) // 10, n,
+                                           replace=False) * 10. + 20),
+                        rng.randint(0, route.lane_num, n))
+
+    agents = Agents(fleet)
+    agents.add(LaneKeeping(), np.arange(0, n, 10), rng.uniform(18, 22))
+    drivers = np.arange(n) % 10 != 0
+    idm = agents.add(IDM(), drivers, rng.uniform(20, 30, n - n // 10))
+    agents.add(LaneChange(idm), drivers)
+    agents.attach(sim)
+
+    steps = 1000
+    start = time.time()
+    min_gap = np.inf
+    for _ in range(steps):
+        sim.step()
+        min_gap = min(min_gap, agents.perception.lead_gap[1].min())
+    print("%d agents: %.0f steps/s, %d lane changes, min gap %.1f m, "
+          "mean speed %.1f m/s" %
+          (n, steps / (time.time() - start), agents.lane_changes,
+           min_gap, fleet.v.mean()))
+
+    # a 12 m simulator truck 40 m ahead of a fleet car, and a fleet car
+    # alone in its lane: no leader reads as speed 0 at an infinite gap
+    sim = Simulator(route)
+    truck = sim.add_car(s=140, lane=0, v=15)
+    truck.set_length_width(12, 2.5)
+    fleet = sim.add_fleet(Fleet(route, 2))
+    fleet.move_to_route(np.array([100., 500.]), np.array([0, 2]))
+    perception = Perception(fleet)
+    perception.update(sim)
+    print("lead gaps %s m (expected %.1f, inf), lead speeds %s m/s" %
+          (perception.lead_gap[1], 40 - (fleet.length + 12) / 2.,
+           perception.lead_v[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Headless benchmark suite of the hot paths: route reading, pose queries,
+JMT solves, trajectory sampling and lattices, stepping cars and Agg rendering.
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline results.json --threshold 0.2
+
+Every metric is the best of --repeat runs, which is the most stable
+figure on a busy machine. Metric names end in their unit: _per_s is
+better when higher, _ms and _us are better when lower. With a baseline,
+metrics worse by more than threshold are listed as regressions and the
+exit status is 1.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+
+def best_time(function, repeat=5, number=1):
+    """
+    Lowest time of one call over repeat runs of number calls.
+    """
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def make_csv(path, n, spacing=30.):
+    """
+    Writes a circular loop of n waypoints in the highway_map.csv format.
+    """
+    radius = n * spacing / (2 * math.pi)
+    angle = np.arange(n) * spacing / radius
+    x, y = radius * np.cos(angle), radius * np.sin(angle)
+    # d grows to the right of the (counter clockwise) direction of travel
+    dx, dy = np.cos(angle), np.sin(angle)
+    np.savetxt(path, np.column_stack([x, y, np.arange(n) * spacing, dx, dy]),
+               delimiter=',', header='x,y,s,dx,dy', comments='', fmt='%.6f')
+
+
+def load_route():
+    from map import Route
+    route = Route()
+    route.read("highway_map.csv")
+    return route
+
+
+def bench_route_read(repeat):
+    from map import Route
+    folder = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name, n in (('small', 1000), ('large', 100000)):
+            path = os.path.join(folder, '%s.csv' % name)
+            make_csv(path, n)
+            results['read_csv_%s_ms' % name] = best_time(
+                lambda: Route().read(path, cache=False), repeat) * 1e3
+            Route().read(path, cache=True)
+            results['read_cached_%s_ms' % name] = best_time(
+                lambda: Route().read(path, cache=True), repeat) * 1e3
+    finally:
+        shutil.rmtree(folder)
+    return results
+
+
+def bench_route_queries(repeat):
+    route = load_route()
+    rng = np.random.RandomState(0)
+    s = rng.uniform(0, route.length, 1000)
+    d = rng.uniform(0, route.lane_width * route.lane_num, 1000)
+    many_s = rng.uniform(0, route.length, 100000)
+    many_d = rng.uniform(0, route.lane_width * route.lane_num, 100000)
+
+    def to_pose():
+        for i in range(1000):
+            route.to_pose(s[i], d[i])
+
+    def get_idx():
+        for i in range(1000):
+            route.get_idx(s[i])
+    return {'to_pose_per_s': 1000 / best_time(to_pose, repeat),
+            'get_idx_per_s': 1000 / best_time(get_idx, repeat),
+            'to_pose_many_per_s':
+                1e5 / best_time(lambda: route.to_pose_many(many_s, many_d),
+                                repeat)}
+
+
+def bench_jmt(repeat):
+    from benchmark_jmt import random_states
+    from trajectory_generation import TrajectoryGenerator
+    traj_gen = TrajectoryGenerator()
+    start, goal, T = random_states(100000)
+
+    def loop():
+        for i in range(1000):
+            traj_gen.jmt(start[i], goal[i], T[i])
+    return {'jmt_per_s': 1000 / best_time(loop, repeat),
+            'jmt_batch_per_s':
+                1e5 / best_time(lambda: traj_gen.jmt_batch(start, goal, T),
+                                repeat)}
+
+
+def bench_sampling(repeat):
+    from benchmark_jmt import random_states
+    from trajectory_generation import TrajectoryGenerator
+    traj_gen = TrajectoryGenerator()
+    start, goal, _ = random_states(1000)
+    coefs = traj_gen.jmt_batch(start, goal, 3.)
+    out = np.empty((4, len(coefs), len(traj_gen.sample_times(3.))))
+    return {'sample_per_s':
+            1000 / best_time(lambda: traj_gen.evaluate(coefs, 3., out=out),
+                             repeat, 10)}
+
+
+def bench_lattice(repeat):
+    from trajectory_generation import TrajectoryGenerator
+    route = load_route()
+    traj_gen = TrajectoryGenerator()
+    options = dict(horizons=np.linspace(2, 5, 4),
+                   speeds=np.linspace(10, 25, 7), accelerations=(-1, 0, 1))
+
+    def generate():
+        traj_gen.clear()
+        traj_gen.generate_lattice(route, [100., 15., 0.], [1.75, 0., 0.],
+                                  **options)
+    n = len(traj_gen.lattice(route, [100., 15., 0.], [1.75, 0., 0.],
+                             **options))
+    return {'lattice_candidates_per_s': n / best_time(generate, repeat, 10)}
+
+
+def bench_follow_route(repeat):
+    from benchmark_fleet import make_fleet
+    from car import Car
+    route = load_route()
+    fleet = make_fleet(route, 1000)
+    cars = []
+    for i in range(100):
+        car = Car()
+        car.set_route(route, fleet.s[i], fleet.lane[i])
+        car.v = fleet.v[i]
+        cars.append(car)
+
+    def step_cars():
+        for car in cars:
+            car.follow_route()
+    return {'fleet_1000_steps_per_s':
+            1 / best_time(fleet.follow_route, repeat, 20),
+            'cars_100_steps_per_s': 1 / best_time(step_cars, repeat, 5)}
+
+
+def bench_render(repeat):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from benchmark_fleet import make_fleet
+    from map import Map
+    from renderer import Renderer
+    from trajectory_generation import TrajectoryGenerator
+    figure = Figure(figsize=(12, 8), dpi=100)
+    FigureCanvasAgg(figure)
+    route_map = Map()
+    route_map.read("highway_map.csv")
+    route = route_map.route
+    fleet = make_fleet(route, 100)
+    fleet.move_to_route(np.linspace(0, 400, 100), fleet.lane)
+    traj_gen = TrajectoryGenerator()
+    rng = np.random.RandomState(0)
+    goal_s = np.column_stack([fleet.s[0] + 60 + rng.uniform(-10, 10, 50),
+                              np.full(50, 20.), np.zeros(50)])
+    _, s = traj_gen.evaluate(traj_gen.jmt_batch(
+        np.tile([fleet.s[0], 20., 0.], (50, 1)), goal_s, 3.), 3.)
+    x, y, _ = route.to_pose_many(s, np.full(s.shape, fleet.d[0]))
+
+    renderer = Renderer(figure.add_subplot(111))
+    renderer.set_map(route_map)
+    renderer.set_trajectories(x, y)
+
+    def frame():
+        fleet.follow_route(0.05)
+        renderer.set_camera(fleet.x[0], fleet.y[0], fleet.s[0])
+        renderer.set_cars(fleet.x, fleet.y, fleet.yaw)
+        renderer.render()
+    frame()
+    return {'frame_ms': best_time(frame, repeat, 10) * 1e3}
+
+
+BENCHMARKS = [
+    ('route_read', bench_route_read),
+    ('route_queries', bench_route_queries),
+    ('jmt', bench_jmt),
+    ('sampling', bench_sampling),
+    ('lattice', bench_lattice),
+    ('follow_route', bench_follow_route),
+    ('render', bench_render),
+]
+
+
+def run(names=None, repeat=5):
+    results = {}
+    for name, bench in BENCHMARKS:
+        if names and name not in names:
+            continue
+        start = time.time()
+        results[name] = bench(repeat)
+        print("%-14s %6.1f s" % (name, time.time() - start))
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'results': results}
+
+
+def higher_is_better(metric):
+    return metric.endswith('_per_s')
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Returns rows (benchmark, metric, baseline, current, change, regressed)
+    for the metrics in both runs, change > 0 is an improvement.
+    """
+    rows = []
+    for name, metrics in sorted(current['results'].items()):
+        known = baseline['results'].get(name, {})
+        for metric, value in sorted(metrics.items()):
+            if metric not in known:
+                continue
+            ratio = value / known[metric]
+            change = ratio - 1 if higher_is_better(metric) else 1 / ratio - 1
+            rows.append((name, metric, known[metric], value, change,
+                         change < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="compare to a results JSON")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="relative slowdown counted as a regression")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*',
+                        choices=[name for name, _ in BENCHMARKS])
+    args = parser.parse_args()
+
+    current = run(args.only, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    rows = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(current, json.load(f), args.threshold)
+        print("%-14s %-24s %12s %12s %8s" %
+              ("benchmark", "metric", "baseline", "current", "change"))
+        for name, metric, old, new, change, regressed in rows:
+            print("%-14s %-24s %12.4g %12.4g %+7.1f%%%s" %
+                  (name, metric, old, new, change * 100,
+                   "  REGRESSION" if regressed else ""))
+    else:
+        for name, metrics in sorted(current['results'].items()):
+            for metric, value in sorted(metrics.items()):
+                print("%-14s %-24s %12.4g" % (name, metric, value))
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import time
+import numpy as np
+from car import Car
+from fleet import Fleet
+from map import Route
+
+
+def make_fleet(route, n, seed=0):
+    rng = np.random.RandomState(seed)
+    fleet = Fleet(route, n)
+    fleet.v[:] = rng.uniform(10, 30, n)
+    fleet.move_to_route(rng.uniform(0, route.s[-1], n),
+                        rng.randint(0, route.lane_num, n))
+    return fleet
+
+
+def bench_fleet(route, n, steps):
+    fleet = make_fleet(route, n)
+    start = time.time()
+    for _ in range(steps):
+        fleet.follow_route()
+    return steps / (time.time() - start)
+
+
+def bench_cars(route, n, steps):
+    fleet = make_fleet(route, n)
+    cars = []
+    for i in range(n):
+        car = Car()
+        car.set_route(route, fleet.s[i], fleet.lane[i])
+        car.v = fleet.v[i]
+        cars.append(car)
+    start = time.time()
+    for _ in range(steps):
+        for car in cars:
+            car.follow_route()
+    return steps / (time.time() - start)
+
+
+def main():
+    print("Benchmark Fleet.follow_route vs per-Car follow_route")
+    route = Route()
+    route.read("highway_map.csv")
+    print("%8s %14s %14s" % ("N", "fleet [step/s]", "cars [step/s]"))
+    for n, steps in [(10, 2000), (1000, 500), (100000, 20)]:
+        fleet = bench_fleet(route, n, steps)
+        cars = bench_cars(route, n, max(steps // 10, 1)) if n <= 1000 \
+            else float('nan')
+        print("%8d %14.1f %14.1f" % (n, fleet, cars))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import time
+import numpy as np
+from trajectory_generation import TrajectoryGenerator
+
+
+def random_states(n, seed=0):
+    rng = np.random.RandomState(seed)
+    start = np.column_stack([rng.uniform(0, 100, n),
+                             rng.uniform(0, 30, n),
+                             rng.uniform(-2, 2, n)])
+    goal = np.column_stack([start[:, 0] + rng.uniform(20, 120, n),
+                            rng.uniform(0, 30, n),
+                            rng.uniform(-2, 2, n)])
+    T = rng.uniform(1, 8, n)
+    return start, goal, T
+
+
+def bench_loop(traj_gen, start, goal, T):
+    t0 = time.time()
+    result = [traj_gen.jmt(a, b, t) for a, b, t in zip(start, goal, T)]
+    return time.time() - t0, np.array(result)
+
+
+def bench_batch(traj_gen, start, goal, T):
+    t0 = time.time()
+    result = traj_gen.jmt_batch(start, goal, T)
+    return time.time() - t0, result
+
+
+def main():
+    print("Benchmark jmt loop vs jmt_batch")
+    traj_gen = TrajectoryGenerator()
+    print("%8s %12s %12s %10s %12s" %
+          ("N", "loop [s]", "batch [s]", "speedup", "max err"))
+    for n in [10, 1000, 100000]:
+        start, goal, T = random_states(n)
+        t_loop, loop = bench_loop(traj_gen, start, goal, T)
+        t_batch, batch = bench_batch(traj_gen, start, goal, T)
+        err = np.max(np.abs(loop - batch) / (1 + np.abs(loop)))
+        print("%8d %12.6f %12.6f %10.1f %12.2e" %
+              (n, t_loop, t_batch, t_loop / max(t_batch, 1e-9), err))
+
+
+if __name__ == "__main__":
+    main()
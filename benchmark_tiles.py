@@ -0,0 +1,85 @@
+import os
+import tempfile
+import time
+import numpy as np
+import route_format
+from map import Route, TiledRoute
+
+
+def make_route(path, km, spacing=30., chunk=100000):
+    """
+    Writes a winding, open synthetic route of km kilometers as a binary
+    route file, chunk waypoints at a time so it never sits in memory.
+    """
+    n = int(km * 1000 / spacing) + 1
+    data = route_format.create(path, {'route': (len(Route.FIELDS), n)},
+                               is_loop=False)['route']
+    x, y = 0., 0.
+    for lo in range(0, n, chunk):
+        s = np.arange(lo, min(lo + chunk, n)) * spacing
+        yaw = 0.8 * np.sin(s / 3000.) + 0.3 * np.sin(s / 700. + 1)
+        sx, sy = np.cos(yaw), np.sin(yaw)
+        cx = x + np.cumsum(sx) * spacing
+        cy = y + np.cumsum(sy) * spacing
+        data[0, lo:lo + len(s)] = np.append(x, cx[:-1])
+        data[1, lo:lo + len(s)] = np.append(y, cy[:-1])
+        data[2, lo:lo + len(s)] = s
+        # d grows to the right of the direction of travel
+        data[3, lo:lo + len(s)] = sy
+        data[4, lo:lo + len(s)] = -sx
+        data[5, lo:lo + len(s)] = sx
+        data[6, lo:lo + len(s)] = sy
+        data[7, lo:lo + len(s)] = yaw
+        x, y = cx[-1], cy[-1]
+    data.flush()
+    return n
+
+
+def drive(route, steps, seed=0):
+    """
+    One ego car driving at 30 m/s from a random start, each step queries
+    its pose, the poses of 50 cars around it and the drawing window.
+    Returns the mean step time in microseconds.
+    """
+    rng = np.random.RandomState(seed)
+    s = rng.uniform(0, route.length - steps * 3. - 1000)
+    offsets = rng.uniform(-200, 200, 50)
+    d = rng.uniform(0, route.lane_width * route.lane_num, 50)
+    start = time.time()
+    for _ in range(steps):
+        s += 3.
+        route.to_pose(s, 5.)
+        route.to_pose_many(np.maximum(s + offsets, 0), d)
+        route.get_window(s - 100, s + 300)
+    return (time.time() - start) / steps * 1e6
+
+
+def main():
+    print("Benchmark TiledRoute vs fully loaded Route on synthetic routes")
+    folder = tempfile.mkdtemp()
+    print("%8s %10s %12s %12s %12s %12s" %
+          ("km", "waypoints", "full [MB]", "tiles [kB]",
+           "full [us]", "tiled [us]"))
+    for km in [100, 1000, 10000]:
+        path = os.path.join(folder, "synthetic_%d.route" % km)
+        n = make_route(path, km)
+
+        tiled = TiledRoute(tile_length=1000., max_tiles=8)
+        tiled.read(path)
+        tiled_time = drive(tiled, 500)
+
+        full = Route()
+        full.read(path)
+        full.set_data(np.array(full.data))
+        full_time = drive(full, 500)
+
+        print("%8d %10d %12.1f %12.1f %12.1f %12.1f" %
+              (km, n, full.data.nbytes / 1e6, tiled.memory() / 1e3,
+               full_time, tiled_time))
+        del tiled, full
+        os.remove(path)
+    os.rmdir(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,52 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.lines import Line2D
-from matplotlib.text import Annotation
 import math
+import numpy as np
+
+
+def box_outline(length, width):
+    """
+    (7, 2) outline of a car in its own frame: the box from -0.3 to 0.7
+    length and -0.5 to 0.5 width around the pose, then a nose marker.
+    """
+    return np.column_stack([
+        (np.array([0, 1, 1, 0, 0, 0.3, 0]) - 0.3) * length,
+        (np.array([0, 0, 1, 1, 0, 0.5, 1]) - 0.5) * width])
+
+
+def rotations(yaw):
+    """
+    (N, 2, 2) rotation matrices, cos and sin are computed once per yaw.
+    """
+    c, s = np.cos(yaw), np.sin(yaw)
+    return np.stack([np.stack([c, -s], axis=-1),
+                     np.stack([s, c], axis=-1)], axis=-2)
+
+
+def local_to_global_many(points, x, y, yaw):
+    """
+    Maps points given in the frames of N poses to the global frame.
+    points is (K, 2), shared by all poses, or (N, K, 2), x, y, yaw are
+    (N,). Returns (N, K, 2).
+    """
+    x, y, yaw = np.atleast_1d(x, y, yaw)
+    return np.matmul(points, rotations(yaw).transpose(0, 2, 1)) + \
+        np.stack([x, y], axis=-1)[:, np.newaxis]
+
+
+def global_to_local_many(points, x, y, yaw):
+    """
+    Inverse of local_to_global_many: global points, (K, 2) or (N, K, 2),
+    expressed in the frame of each of N poses. Returns (N, K, 2).
+    """
+    x, y, yaw = np.atleast_1d(x, y, yaw)
+    return np.matmul(points - np.stack([x, y], axis=-1)[:, np.newaxis],
+                     rotations(yaw))
+
+
+def outlines(x, y, yaw, length=5, width=2):
+    """
+    (N, 7, 2) outlines of N cars of one size in one matrix multiply.
+    """
+    return local_to_global_many(box_outline(length, width), x, y, yaw)
 
 
 class Car:
@@ -11,10 +55,24 @@ class Car:
         self.v = 0
         self.set_pose(0, 0, 0)
         self.set_length_width(length, width)
+        self.label_text = label
+        self.color = color
+        self.label = None
+        self.bbox = None
+        if axes:
+            self.add_to(axes)
+
+    def add_to(self, axes=None):
+        """
+        Creates the bounding box and label artists, matplotlib is only
+        imported here so headless runs never load it.
+        """
+        from matplotlib.lines import Line2D
+        from matplotlib.text import Annotation
         self.label = Annotation(
-            label, [0, 0], size='small', annotation_clip=False)
+            self.label_text, [0, 0], size='small', annotation_clip=False)
         self.label.set_rotation_mode('anchor')
-        self.bbox = Line2D([], [], 2, color=color)
+        self.bbox = Line2D([], [], linewidth=2, color=self.color)
         if axes:
             axes.add_line(self.bbox)
             axes.add_artist(self.label)
@@ -22,13 +80,9 @@ class Car:
     def set_length_width(self, length, width):
         self.length = length    # x dir
         self.width = width      # y dir
-        self._bbox_x = [0, length, length, 0, 0, length * 0.3, 0]
-        self._bbox_y = [0, 0, width, width, 0, width * 0.5, width]
-        for i in range(0, len(self._bbox_x)):
-            self._bbox_x[i] -= length * 0.3
-            self._bbox_y[i] -= width * 0.5
-        self.bbox_x = [[], [], [], [], [], [], [], ]
-        self.bbox_y = [[], [], [], [], [], [], [], ]
+        self.outline = box_outline(length, width)
+        self.bbox_x = []
+        self.bbox_y = []
 
     def set_route(self, route, s=0,lane=0):
         self.route = route
@@ -45,7 +99,7 @@ class Car:
         self.x, self.y,self.yaw = self.route.to_center_pose(s,lane)
 
     def follow_route(self, dt=0.1):
-        self.s += self.v * dt
+        self.s = self.route.wrap_s(self.s + self.v * dt)
         self.x, self.y,self.yaw = self.route.to_center_pose(self.s,self.lane)
         self.route_idx = self.route.get_idx(self.s)
 
@@ -57,16 +111,17 @@ class Car:
         self.x, self.y, self.yaw = x, y, yaw
 
     def draw(self, axes=None):
-        # Update bounding box
-        for i in range(0, len(self._bbox_x)):
-            self.bbox_x[i], self.bbox_y[i] = self.local_to_global(self._bbox_x[i],
-                                                                  self._bbox_y[i])
+        if self.bbox is None:
+            self.add_to(axes)
+
+        # Update bounding box and label position in one transform
+        points = np.vstack([self.outline, [[0.7, -0.2]]])
+        points = local_to_global_many(points, self.x, self.y, self.yaw)[0]
+        self.bbox_x, self.bbox_y = points[:-1, 0], points[:-1, 1]
         self.bbox.set_data(self.bbox_x, self.bbox_y)
 
-        # Update label position
-        label_x, label_y = self.local_to_global(0.7, -0.2)
-        self.label.set_x(label_x)
-        self.label.set_y(label_y)
+        self.label.set_x(points[-1, 0])
+        self.label.set_y(points[-1, 1])
         self.label.set_rotation(self.yaw / math.pi * 180)
 
         return [self.bbox, self.label]
@@ -80,18 +135,31 @@ class Car:
         x_, y_ = self.rotate(x, y, self.yaw)
         return x_ + self.x, y_ + self.y
 
-    def global_to_local(self, x, y, offset, yaw):
-        x_, y_ = x - self.x, y - self.y
-        return self.rotate(x_, y_, -self.yaw)
+    def global_to_local(self, x, y, offset=None, yaw=None):
+        """
+        Expresses a global point in the frame at offset (x, y) rotated by
+        yaw, by default the car's own pose.
+        """
+        if offset is None:
+            offset = (self.x, self.y)
+        if yaw is None:
+            yaw = self.yaw
+        x_, y_ = x - offset[0], y - offset[1]
+        return self.rotate(x_, y_, -yaw)
+
+    def corners(self):
+        """
+        (7, 2) global outline of the car.
+        """
+        return local_to_global_many(self.outline, self.x, self.y,
+                                    self.yaw)[0]
 
     def to_figure_angle(self, radian):
         return -radian / math.pi * 180.
 
 
-t = Annotation('car0', xy=(2, 1), xytext=(3, 1.5), color='black')
-
-
 def main():
+    import matplotlib.pyplot as plt
     print("Test Car class")
     fig1 = plt.figure()
     ax1 = fig1.add_subplot(111, aspect='equal')
@@ -0,0 +1,137 @@
+import math
+import numpy as np
+from trajectory_generation import TrajectoryGenerator
+
+
+def obb_overlap(a_x, a_y, a_yaw, a_half_l, a_half_w,
+                b_x, b_y, b_yaw, b_half_l, b_half_w):
+    """
+    Separating-axis test between oriented boxes given by center, yaw and
+    half extents. All arguments broadcast, returns a bool array.
+    """
+    a_c, a_s = np.cos(a_yaw), np.sin(a_yaw)
+    b_c, b_s = np.cos(b_yaw), np.sin(b_yaw)
+    tx, ty = b_x - a_x, b_y - a_y
+    overlap = True
+    for ux, uy in [(a_c, a_s), (-a_s, a_c), (b_c, b_s), (-b_s, b_c)]:
+        r_a = a_half_l * np.abs(a_c * ux + a_s * uy) + \
+            a_half_w * np.abs(-a_s * ux + a_c * uy)
+        r_b = b_half_l * np.abs(b_c * ux + b_s * uy) + \
+            b_half_w * np.abs(-b_s * ux + b_c * uy)
+        overlap = overlap & (np.abs(tx * ux + ty * uy) <= r_a + r_b)
+    return overlap
+
+
+def box_center(x, y, yaw, length):
+    """
+    Center of a Car bounding box, which spans -0.3 to 0.7 length around
+    the pose (see Car.set_length_width).
+    """
+    offset = 0.2 * length
+    return x + offset * np.cos(yaw), y + offset * np.sin(yaw)
+
+
+class CollisionChecker:
+    """
+    Checks candidate trajectories against other vehicles predicted at
+    constant speed along their lane.
+
+    Broad phase: every (time step, s) sample of the obstacles is put on one
+    sorted key axis, so the obstacles near an ego sample are a
+    searchsorted range. Only those pairs that are also close in d go to the
+    vectorized separating-axis narrow phase in Cartesian coordinates.
+    """
+
+    def __init__(self, route, length=5, width=2,
+                 obs_length=5, obs_width=2, traj_gen=None):
+        self.route = route
+        self.length = length
+        self.width = width
+        self.obs_length = obs_length
+        self.obs_width = obs_width
+        self.traj_gen = traj_gen or TrajectoryGenerator()
+
+    def check(self, coefs_s, coefs_d, T, obs_s, obs_d, obs_v, dt=0.1):
+        """
+        coefs_s, coefs_d are (N, 6) candidates sharing horizon T, obstacles
+        are (M,) arrays. Returns (collides, first_t): a bool per candidate
+        and the time of its first collision, inf when there is none.
+        """
+        t, S = self.traj_gen.evaluate(coefs_s, T, dt)
+        _, D = self.traj_gen.evaluate(coefs_d, T, dt)
+        n, k = S.shape[1:]
+        first = np.full(n, np.inf)
+        obs_s = np.asarray(obs_s, dtype=float)
+        if not len(obs_s) or not n:
+            return np.zeros(n, dtype=bool), first
+
+        ego_s, ego_d = self.route.wrap_s(S[0]), D[0]
+        step = np.broadcast_to(np.arange(k), (n, k))
+        pred_s = self.route.wrap_s(obs_s + np.outer(t, obs_v))
+        pred_d = np.broadcast_to(np.asarray(obs_d, dtype=float), pred_s.shape)
+        pred_step = np.broadcast_to(np.arange(k)[:, np.newaxis], pred_s.shape)
+        pred_s, pred_d, pred_step = \
+            pred_s.ravel(), pred_d.ravel(), pred_step.ravel()
+
+        reach = 0.5 * (math.hypot(self.length, self.width) +
+                       math.hypot(self.obs_length, self.obs_width))
+        if self.route.is_loop:
+            # copies across the seam so wrapped neighbours are found too
+            length = self.route.length
+            low, high = pred_s < reach, pred_s > length - reach
+            pred_s = np.concatenate(
+                [pred_s, pred_s[low] + length, pred_s[high] - length])
+            pred_d = np.concatenate([pred_d, pred_d[low], pred_d[high]])
+            pred_step = np.concatenate(
+                [pred_step, pred_step[low], pred_step[high]])
+
+        # broad phase on s within each time step
+        span = 4 * reach + np.ptp(np.concatenate([pred_s, ego_s.ravel()]))
+        keys = pred_step * span + pred_s
+        order = np.argsort(keys)
+        keys = keys[order]
+        ego_keys = (step * span + ego_s).ravel()
+        lo = np.searchsorted(keys, ego_keys - reach)
+        hi = np.searchsorted(keys, ego_keys + reach)
+        counts = hi - lo
+        ego_idx = np.repeat(np.arange(n * k), counts)
+        obs_idx = order[np.repeat(lo - np.cumsum(counts) + counts, counts) +
+                        np.arange(counts.sum())]
+        near = np.abs(ego_d.ravel()[ego_idx] - pred_d[obs_idx]) <= reach
+        ego_idx, obs_idx = ego_idx[near], obs_idx[near]
+        if not len(ego_idx):
+            return np.zeros(n, dtype=bool), first
+
+        # narrow phase
+        ego_x, ego_y, ego_yaw = self.route.to_pose_many(
+            ego_s.ravel()[ego_idx], ego_d.ravel()[ego_idx])
+        # d grows to the right of the route, so lateral motion turns right
+        ego_yaw = ego_yaw - np.arctan2(D[1].ravel()[ego_idx],
+                                       S[1].ravel()[ego_idx])
+        ego_x, ego_y = box_center(ego_x, ego_y, ego_yaw, self.length)
+        obs_x, obs_y, obs_yaw = self.route.to_pose_many(
+            self.route.wrap_s(pred_s[obs_idx]), pred_d[obs_idx])
+        obs_x, obs_y = box_center(obs_x, obs_y, obs_yaw, self.obs_length)
+        hit = obb_overlap(ego_x, ego_y, ego_yaw,
+                          self.length / 2., self.width / 2.,
+                          obs_x, obs_y, obs_yaw,
+                          self.obs_length / 2., self.obs_width / 2.)
+
+        ego_idx = ego_idx[hit]
+        np.minimum.at(first, ego_idx // k, t[ego_idx % k])
+        return np.isfinite(first), first
+
+    def check_generator(self, traj_gen, obs_s, obs_d, obs_v, dt=0.1):
+        """
+        Checks every candidate stored in a TrajectoryGenerator, grouped by
+        horizon.
+        """
+        coefs = np.array(traj_gen.traj_coefs, dtype=float).reshape(-1, 2, 6)
+        horizons = np.array(traj_gen.t, dtype=float)
+        collides = np.zeros(len(horizons), dtype=bool)
+        first = np.full(len(horizons), np.inf)
+        for T in np.unique(horizons):
+            rows = horizons == T
+            collides[rows], first[rows] = self.check(
+                coefs[rows, 0], coefs[rows, 1], T, obs_s, obs_d, obs_v, dt)
+        return collides, first
@@ -0,0 +1,118 @@
+import numpy as np
+from car import Car, global_to_local_many, outlines
+
+
+class Fleet:
+    """
+    Struct-of-arrays storage for many vehicles on one route. Every field
+    is an (N,) array and follow_route / drive advance all rows at once.
+    """
+    FIELDS = ('s', 'd', 'lane', 'v', 'x', 'y', 'yaw', 'route_idx')
+    INT_FIELDS = ('lane', 'route_idx')
+
+    def __init__(self, route=None, n=0, length=5, width=2):
+        self.route = route
+        self.length = length
+        self.width = width
+        for field in self.FIELDS:
+            dtype = np.int64 if field in self.INT_FIELDS else float
+            setattr(self, field, np.zeros(n, dtype=dtype))
+
+    def __len__(self):
+        return len(self.s)
+
+    def add_car(self, s=0, lane=0, v=0):
+        """
+        Appends one vehicle placed on the route and returns its view.
+        """
+        for field in self.FIELDS:
+            setattr(self, field, np.append(getattr(self, field), 0))
+        idx = len(self) - 1
+        self.v[idx] = v
+        self.move_to_route(s, lane, idx)
+        return self.car(idx)
+
+    def car(self, idx, **kwargs):
+        return FleetCar(self, idx, **kwargs)
+
+    def move_to_route(self, s, lane=0, idx=slice(None)):
+        self.s[idx] = s
+        self.lane[idx] = lane
+        self.d[idx] = self.route.to_d_many(self.lane[idx])
+        self.route_idx[idx] = self.route.get_idx(self.s[idx])
+        self.x[idx], self.y[idx], self.yaw[idx] = \
+            self.route.to_center_pose_many(self.s[idx], self.lane[idx])
+
+    def follow_route(self, dt=0.1):
+        """
+        Advances s by v * dt, wrapped on loop routes, and places every
+        vehicle at its d, which move_to_route sets to the lane center.
+        Fields are updated in place, so views of them stay current.
+        """
+        self.s += self.v * dt
+        self.route.wrap_s(self.s, out=self.s)
+        self.x[:], self.y[:], self.yaw[:] = \
+            self.route.to_pose_many(self.s, self.d)
+        self.route_idx[:] = self.route.get_idx(self.s)
+
+    def drive(self, dt=0.1):
+        self.x += self.v * np.cos(self.yaw) * dt
+        self.y += self.v * np.sin(self.yaw) * dt
+
+    def outlines(self):
+        """
+        (N, 7, 2) global outlines of all vehicles.
+        """
+        return outlines(self.x, self.y, self.yaw, self.length, self.width)
+
+    def to_local(self, points):
+        """
+        Global points, (K, 2) or (N, K, 2), in every vehicle's frame as an
+        (N, K, 2) array, e.g. the other vehicles relative to each one.
+        """
+        return global_to_local_many(points, self.x, self.y, self.yaw)
+
+
+def _column(field):
+    def get(self):
+        return getattr(self.fleet, field)[self.idx]
+
+    def set(self, value):
+        getattr(self.fleet, field)[self.idx] = value
+    return property(get, set)
+
+
+class FleetCar(Car):
+    """
+    Car whose state lives in one row of a Fleet, so the scalar Car API
+    and the fleet's vectorized steps see the same values.
+    """
+    s = _column('s')
+    d = _column('d')
+    lane = _column('lane')
+    v = _column('v')
+    x = _column('x')
+    y = _column('y')
+    yaw = _column('yaw')
+    route_idx = _column('route_idx')
+
+    def __init__(self, fleet, idx, axes=None, label=None, color='black'):
+        # Car.__init__ would reset the row's pose and speed
+        self.fleet = fleet
+        self.idx = idx
+        self.id = idx
+        self.set_length_width(fleet.length, fleet.width)
+        self.label_text = str(idx) if label is None else label
+        self.color = color
+        self.label = None
+        self.bbox = None
+        if axes:
+            self.add_to(axes)
+
+    @property
+    def route(self):
+        return self.fleet.route
+
+    @route.setter
+    def route(self, route):
+        self.fleet.route = route
@@ -0,0 +1,122 @@
+import collections
+import time
+import numpy as np
+
+
+class JMTCache:
+    """
+    Caches for repeated jerk minimizing trajectory solves.
+
+    The 3x3 matrix A of jmt depends on T only, so its inverse is cached
+    per T and a solve is one mat-vec. With a quantum, whole solutions are
+    memoized too: a_3, a_4, a_5 only depend on T, the displacement
+    end[0] - start[0] and the start/end speeds and accelerations, which
+    are rounded to multiples of quantum for the key. A memoized solution
+    is the exact one for the rounded states (plus the exact start[0]), so
+    results do not depend on whether a lookup hit. Both caches evict the
+    least recently used entry beyond their size.
+    """
+
+    def __init__(self, max_inverses=64, max_solutions=4096, quantum=None):
+        self.max_inverses = max_inverses
+        self.max_solutions = max_solutions
+        self.quantum = quantum
+        self.inverses = collections.OrderedDict()
+        self.solutions = collections.OrderedDict()
+        self.inverse_hits = 0
+        self.inverse_misses = 0
+        self.hits = 0
+        self.misses = 0
+
+    def inverse(self, T):
+        """
+        Returns the cached inverse of A for horizon T.
+        """
+        A_inv = self.inverses.pop(T, None)
+        if A_inv is None:
+            self.inverse_misses += 1
+            A_inv = np.linalg.inv(np.array([
+                [T**3, T**4, T**5],
+                [3 * T**2, 4 * T**3, 5 * T**4],
+                [6 * T, 12 * T**2, 20 * T**3],
+            ]))
+            if len(self.inverses) >= self.max_inverses:
+                self.inverses.popitem(last=False)
+        else:
+            self.inverse_hits += 1
+        self.inverses[T] = A_inv
+        return A_inv
+
+    def jmt(self, start, end, T):
+        """
+        Same result as TrajectoryGenerator.jmt, from the caches.
+        """
+        a_0 = float(start[0])
+        a_1, a_2 = float(start[1]), float(start[2])
+        delta, v, acc = float(end[0]) - a_0, float(end[1]), float(end[2])
+        if self.quantum is None:
+            return np.concatenate([[a_0], self._solve(delta, a_1, a_2,
+                                                      v, acc, T)])
+
+        q = self.quantum
+        key = (T, round(delta / q), round(a_1 / q), round(a_2 / q),
+               round(v / q), round(acc / q))
+        alphas = self.solutions.pop(key, None)
+        if alphas is None:
+            self.misses += 1
+            alphas = self._solve(*[k * q for k in key[1:]] + [T])
+            if len(self.solutions) >= self.max_solutions:
+                self.solutions.popitem(last=False)
+        else:
+            self.hits += 1
+        self.solutions[key] = alphas
+        return np.concatenate([[a_0], alphas])
+
+    def _solve(self, delta, a_1, a_2, v, acc, T):
+        """
+        Coefficients a_1 .. a_5 of a trajectory starting at 0.
+        """
+        B = np.array([delta - (a_1 * T + .5 * a_2 * T**2),
+                      v - (a_1 + a_2 * T),
+                      acc - a_2])
+        return np.concatenate([[a_1, .5 * a_2],
+                               np.dot(self.inverse(T), B)])
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'inverse_hits': self.inverse_hits,
+                'inverse_misses': self.inverse_misses,
+                'solutions': len(self.solutions),
+                'inverses': len(self.inverses)}
+
+
+def main():
+    from trajectory_generation import TrajectoryGenerator
+    print("Test JMTCache class")
+    plain = TrajectoryGenerator()
+    cached = TrajectoryGenerator(cache=JMTCache(quantum=1e-3))
+
+    # the ticks of test_traj_gen: one candidate per lane, T = 3, ego
+    # cruising at 20 m/s in lane 0
+    problems = []
+    for tick in range(2000):
+        start_s = [tick * 2., 20., 0]
+        start_d = [1.75, 0, 0]
+        for lane in range(3):
+            problems.append((start_s, [start_s[0] + 60., 20., 0], 3))
+            problems.append((start_d, [1.75 + 3.5 * lane, 0, 0], 3))
+
+    for traj_gen in (plain, cached):
+        start = time.time()
+        for problem in problems:
+            traj_gen.jmt(*problem)
+        print("%-6s %.1f us per solve" %
+              ('cached' if traj_gen.cache else 'plain',
+               (time.time() - start) / len(problems) * 1e6))
+    error = max(np.abs(plain.jmt(*problem) - cached.jmt(*problem)).max()
+                for problem in problems[:300])
+    print("max difference %.2e, %s" % (error, cached.cache.stats()))
+
+
+if __name__ == "__main__":
+    main()
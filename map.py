@@ -1,68 +1,125 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.lines import Line2D
-from matplotlib.text import Annotation
+import collections
 import math
 import csv
-#import collections # namedtuple
-import bisect
+import numpy as np
+import route_format
 
 
 class Route:
+    FIELDS = ('x', 'y', 's', 'dx', 'dy', 'sx', 'sy', 'yaw')
+
     def __init__(self, lane_width=3.5, lane_num=3):
-        self.x = []
-        self.y = []
-        self.s = []
-        self.sx = []
-        self.sy = []
-        self.dx = []
-        self.dy = []
-        self.yaw = []
         self.lane_width = lane_width
         self.lane_num = lane_num
+        self.is_loop = True
         if lane_num < 1:
             raise("Lane number must > 1")
+        self.set_data(np.zeros((len(self.FIELDS), 0)))
+
+    def set_data(self, data):
+        """
+        Stores all waypoint fields in one contiguous (len(FIELDS), N)
+        float64 block, x, y, s, ... are row views into it.
+        """
+        self.data = data
+        for i, field in enumerate(self.FIELDS):
+            setattr(self, field, data[i])
+        self._frenet_index = None
+
+    def read(self, file, is_loop=True, cache=False):
+        """
+        Reads a waypoint CSV or a binary route file. With cache, a binary
+        copy of the parsed CSV is kept next to it, one per cache_key, and
+        memory-mapped on later reads while the CSV is unchanged. Mapped
+        arrays are copy-on-write, so a cached route can be modified like
+        a parsed one without touching its files.
+        """
+        if file.endswith(route_format.SUFFIX):
+            loaded = route_format.load(file)
+            if loaded is None or not self.set_blocks(loaded[1], loaded[0]):
+                raise ValueError("%s is not a route file for %s" %
+                                 (file, type(self).__name__))
+            return
+        if cache:
+            blocks = route_format.load_cache(file, is_loop, self.cache_key())
+            if blocks is not None and self.set_blocks(blocks, is_loop):
+                return
+        self.read_csv(file, is_loop)
+        if cache:
+            route_format.save_cache(file, is_loop, self.get_blocks(),
+                                    self.cache_key())
+
+    def cache_key(self):
+        """
+        Names the cache file of a source, distinct per class and any
+        parameter the cached blocks depend on.
+        """
+        return type(self).__name__
+
+    def get_blocks(self):
+        """
+        Arrays to store in a binary route file.
+        """
+        return {'route': self.data}
 
-    def read(self, file, is_loop=True):
+    def set_blocks(self, blocks, is_loop):
+        """
+        Restores the route from binary route file blocks, returns False when
+        a block is missing.
+        """
+        if 'route' not in blocks:
+            return False
+        self.is_loop = is_loop
+        self.set_data(blocks['route'])
+        return True
+
+    def read_csv(self, file, is_loop=True):
         with open(file) as csvfile:
             reader = csv.DictReader(csvfile, delimiter=',')
-            self.x[:] = []
-            self.y[:] = []
-            self.s[:] = []
-            self.sx[:] = []
-            self.sy[:] = []
-            self.dx[:] = []
-            self.dy[:] = []
-            self.yaw[:] = []
-            for row in reader:
-                self.x.append(float(row['x']))
-                self.y.append(float(row['y']))
-                self.s.append(float(row['s']))
-                self.dx.append(float(row['dx']))
-                self.dy.append(float(row['dy']))
-
-            def calc(ax, ay, bx, by):
-                yaw = math.atan2(by - ay, bx - ax)
-                length = math.sqrt((bx - ax)**2 + (by - ay)**2)
-                sx = (bx - ax) / length
-                sy = (by - ay) / length
-                return sx, sy, yaw
-
-            for i in range(0, len(self.s) - 1):
-                sx, sy, yaw = calc(
-                    self.x[i], self.y[i], self.x[i + 1], self.y[i + 1])
-                self.yaw.append(yaw)
-                self.sx.append(sx)
-                self.sy.append(sy)
-
-            if is_loop:
-                sx, sy, yaw = calc(
-                    self.x[-1], self.y[-1], self.x[0], self.y[0])
-            else:
-                sx, sy, yaw = self.sx[-1], self.sy[-1], self.yaw[-1]
-            self.yaw.append(yaw)
-            self.sx.append(sx)
-            self.sy.append(sy)
+            rows = [[float(row[field]) for field in self.FIELDS[:5]]
+                    for row in reader]
+
+        data = np.zeros((len(self.FIELDS), len(rows)))
+        data[:5] = np.array(rows).T
+        x, y = data[0], data[1]
+        if is_loop:
+            bx, by = np.roll(x, -1), np.roll(y, -1)
+        else:
+            bx, by = np.append(x[1:], 2 * x[-1] - x[-2]), \
+                np.append(y[1:], 2 * y[-1] - y[-2])
+        length = np.hypot(bx - x, by - y)
+        data[5] = (bx - x) / length
+        data[6] = (by - y) / length
+        data[7] = np.arctan2(by - y, bx - x)
+        self.is_loop = is_loop
+        self.set_data(data)
+
+    @property
+    def length(self):
+        """
+        Total s length, including the closing segment of a loop.
+        """
+        if self.is_loop:
+            return self.s[-1] + math.hypot(self.x[0] - self.x[-1],
+                                           self.y[0] - self.y[-1])
+        return self.s[-1]
+
+    def wrap_s(self, s, out=None):
+        """
+        s wrapped into [0, length) on loops, written into out when given.
+        """
+        if not self.is_loop:
+            if out is None:
+                return s
+            out[...] = s
+            return out
+        if np.ndim(s) == 0 and out is None:
+            return s % self.length
+        # much faster than np.mod on large arrays
+        length = self.length
+        laps = np.floor(np.divide(s, length))
+        laps *= length
+        return np.subtract(s, laps, out=out)
 
     def to_pose(self, s, d):
         idx = self.get_idx(s)
@@ -72,16 +129,181 @@ class Route:
         yaw = self.yaw[idx]
         return x, y, yaw
 
+    def to_pose_many(self, s, d):
+        """
+        Vectorized to_pose for arrays of s and d, returns x, y, yaw arrays.
+        """
+        return self.to_pose(np.asarray(s, dtype=float),
+                            np.asarray(d, dtype=float))
+
+    def to_frenet(self, x, y):
+        s, d = self.to_frenet_many([x], [y])
+        return s[0], d[0]
+
+    def to_frenet_many(self, x, y):
+        """
+        Projects Cartesian points onto the route, returns s and d arrays.
+        Candidate segments come from a uniform grid built on first use,
+        points with no segment within one grid cell fall back to a scan
+        over all segments.
+        """
+        if self._frenet_index is None:
+            self._frenet_index = self._build_frenet_index()
+        cell, origin, keys, table = self._frenet_index
+
+        px = np.asarray(x, dtype=float).ravel()
+        py = np.asarray(y, dtype=float).ravel()
+        key = self._cell_key(np.floor((px - origin[0]) / cell),
+                             np.floor((py - origin[1]) / cell))
+        row = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+        candidates = table[row]
+        candidates[keys[row] != key] = -1
+
+        s, d, dist = self._project(px, py, candidates)
+        # no preimage near the point: a closer one may be in another cell
+        far = dist > cell
+        if np.any(far):
+            every = np.arange(len(self.s))[np.newaxis, :]
+            s[far], d[far], _ = self._project(
+                px[far], py[far], np.repeat(every, np.sum(far), axis=0))
+        return self.wrap_s(s), d
+
+    def _cell_key(self, cx, cy):
+        return cx.astype(np.int64) * (1 << 32) + cy.astype(np.int64)
+
+    def _segment_spans(self):
+        span = np.empty(len(self.s))
+        span[:-1] = np.diff(self.s)
+        span[-1] = self.length - self.s[-1] if self.is_loop else span[-2]
+        return span
+
+    def _build_frenet_index(self):
+        """
+        Registers every segment in the grid cells around its bounding box,
+        so a query only has to look at the cell it falls into. Returns
+        the cell size, grid origin, sorted cell keys and a (cells, K)
+        table of segment indices padded with -1.
+        """
+        ax, ay = self.x, self.y
+        span = self._segment_spans()
+        bx, by = ax + self.sx * span, ay + self.sy * span
+        cell = max(span.max(), self.lane_width * self.lane_num)
+        origin = (min(ax.min(), bx.min()), min(ay.min(), by.min()))
+
+        x0 = np.floor((np.minimum(ax, bx) - origin[0]) / cell) - 1
+        x1 = np.floor((np.maximum(ax, bx) - origin[0]) / cell) + 1
+        y0 = np.floor((np.minimum(ay, by) - origin[1]) / cell) - 1
+        y1 = np.floor((np.maximum(ay, by) - origin[1]) / cell) + 1
+        seg, cx, cy = [], [], []
+        for i in range(len(self.s)):
+            gx, gy = np.meshgrid(np.arange(x0[i], x1[i] + 1),
+                                 np.arange(y0[i], y1[i] + 1))
+            seg.append(np.full(gx.size, i))
+            cx.append(gx.ravel())
+            cy.append(gy.ravel())
+        seg = np.concatenate(seg)
+        key = self._cell_key(np.concatenate(cx), np.concatenate(cy))
+
+        order = np.argsort(key, kind='stable')
+        key, seg = key[order], seg[order]
+        keys, first, counts = np.unique(
+            key, return_index=True, return_counts=True)
+        table = np.full((len(keys), counts.max()), -1, dtype=np.int64)
+        col = np.arange(len(key)) - np.repeat(first, counts)
+        table[np.repeat(np.arange(len(keys)), counts), col] = seg
+        return cell, origin, keys, table
+
+    def _project(self, px, py, candidates):
+        """
+        Solves (p - waypoint) = sx * ds + dx * d on each candidate segment,
+        the exact inverse of to_pose. Segments whose ds lies within their
+        span are exact preimages and the one with the smallest |d| wins;
+        only when no segment contains the point, the one with the smallest
+        clamped distance is taken. Returns s, d and |d| or that distance.
+        """
+        valid = candidates >= 0
+        idx = np.where(valid, candidates, 0)
+        rx = px[:, np.newaxis] - self.x[idx]
+        ry = py[:, np.newaxis] - self.y[idx]
+        sx, sy, dx, dy = self.sx[idx], self.sy[idx], self.dx[idx], self.dy[idx]
+        det = sx * dy - sy * dx
+        ds = (rx * dy - ry * dx) / det
+        d = (sx * ry - sy * rx) / det
+
+        ds_clamped = np.clip(ds, 0, self._segment_spans()[idx])
+        dist = np.hypot(ds - ds_clamped, d)
+        dist[~valid] = np.inf
+        # preimages first: the lateral offset alone must not make a
+        # neighbouring segment with a clamped ds look closer on bends
+        inside = valid & (ds == ds_clamped)
+        contained = inside.any(axis=1)
+        dist[contained] = np.where(inside[contained],
+                                   np.abs(d[contained]), np.inf)
+
+        best = np.argmin(dist, axis=1)
+        rows = np.arange(len(px))
+        s = self.s[idx[rows, best]] + ds_clamped[rows, best]
+        return s, d[rows, best], dist[rows, best]
+
     def to_d(self, lane):
         if lane>=0 : return (lane + 0.5) * self.lane_width
         return (lane - 0.5) * self.lane_width
 
+    def to_d_many(self, lane):
+        lane = np.asarray(lane)
+        return np.where(lane >= 0, lane + 0.5, lane - 0.5) * self.lane_width
+
     def to_center_pose(self, s, lane=0):
         d = self.lane_width * (lane + 0.5)
         return self.to_pose(s, d)
 
+    def to_center_pose_many(self, s, lane):
+        """
+        Vectorized to_center_pose for arrays of s and lane.
+        """
+        d = self.lane_width * (np.asarray(lane) + 0.5)
+        return self.to_pose_many(s, d)
+
     def get_idx(self, s):
-        return bisect.bisect(self.s, s) - 1
+        return np.searchsorted(self.s, s, side='right') - 1
+
+    def get_window(self, s0, s1):
+        """
+        Waypoints covering s0 <= s <= s1 as a (len(FIELDS), K) array. On a
+        loop the window may cross the seam, s of the wrapped waypoints then
+        continues past length.
+        """
+        if not self.is_loop:
+            return self._span(s0, s1)
+        length = self.length
+        pieces = []
+        base = math.floor(s0 / length) * length
+        while base <= s1:
+            piece = self._span(max(s0 - base, 0), min(s1 - base, length))
+            piece[2] += base
+            pieces.append(piece)
+            base += length
+        return np.hstack(pieces)
+
+    def _span(self, s0, s1):
+        """
+        Copy of the waypoints from the one at or before s0 to the one after
+        s1.
+        """
+        i0 = max(int(self.get_idx(s0)), 0)
+        i1 = min(int(self.get_idx(s1)) + 2, len(self.s))
+        return np.array(self.data[:, i0:i1])
+
+    def edge_samples(self, is_loop=True):
+        """
+        s, x, y, dx, dy of the points lane edges are drawn through, the
+        waypoints, with the first repeated at s = length on loops.
+        """
+        x, y, s, dx, dy = self.x, self.y, self.s, self.dx, self.dy
+        if is_loop:
+            x, y, dx, dy = [np.append(a, a[0]) for a in (x, y, dx, dy)]
+            s = np.append(s, self.length)
+        return s, x, y, dx, dy
 
     def get_yaw(self, idx):
         return self.yaw[idx]
@@ -95,42 +317,477 @@ class Route:
             self.y[idx] + self.dy[idx] * self.lane_width * (lane + 0.5)
 
 
+class SplineRoute(Route):
+    """
+    Route interpolated with a cubic spline through the waypoints, x(s) and
+    y(s) are periodic on loops and natural otherwise. On read the spline is
+    resampled every `resolution` meters into a lookup table, so to_pose is
+    index arithmetic on the table instead of a search over waypoints.
+    The table holds 6 float64 per sample, i.e. 96 kB per km at 0.5 m.
+
+    to_frenet, get_window and the drawn lane edges use the table too, so
+    they agree with to_pose. get_idx stays the index of the waypoint at
+    or before s.
+    """
+    TABLE_FIELDS = ('x', 'y', 'yaw', 'k', 'nx', 'ny')
+
+    def __init__(self, lane_width=3.5, lane_num=3, resolution=0.5):
+        Route.__init__(self, lane_width, lane_num)
+        self.resolution = resolution
+        self.table = np.zeros((len(self.TABLE_FIELDS), 0))
+
+    def read_csv(self, file, is_loop=True):
+        Route.read_csv(self, file, is_loop)
+        self.build_table()
+
+    def get_blocks(self):
+        blocks = Route.get_blocks(self)
+        blocks[self._table_block()] = self.table
+        return blocks
+
+    def set_blocks(self, blocks, is_loop):
+        if self._table_block() not in blocks:
+            return False
+        self.table = blocks[self._table_block()]
+        return Route.set_blocks(self, blocks, is_loop)
+
+    def _table_block(self):
+        return 'spline%g' % self.resolution
+
+    def cache_key(self):
+        return '%s%g' % (type(self).__name__, self.resolution)
+
+    def build_table(self):
+        knots = self.s
+        points = np.column_stack([self.x, self.y])
+        if self.is_loop:
+            knots = np.append(knots, self.length)
+            points = np.vstack([points, points[:1]])
+        M = _spline_moments(knots, points, self.is_loop)
+
+        n = int(math.ceil(knots[-1] / self.resolution)) + 1
+        grid = np.arange(n) * self.resolution
+        j = np.clip(np.searchsorted(knots, grid, side='right') - 1,
+                    0, len(knots) - 2)
+        h = (knots[j + 1] - knots[j])[:, np.newaxis]
+        a = (knots[j + 1] - grid)[:, np.newaxis]
+        b = (grid - knots[j])[:, np.newaxis]
+        p0, p1, m0, m1 = points[j], points[j + 1], M[j], M[j + 1]
+        pos = (m0 * a**3 + m1 * b**3) / (6 * h) + \
+            (p0 / h - m0 * h / 6) * a + (p1 / h - m1 * h / 6) * b
+        vel = (m1 * b**2 - m0 * a**2) / (2 * h) + \
+            (p1 - p0) / h - (m1 - m0) * h / 6
+        acc = (m0 * a + m1 * b) / h
+
+        yaw = np.unwrap(np.arctan2(vel[:, 1], vel[:, 0]))
+        k = (vel[:, 0] * acc[:, 1] - vel[:, 1] * acc[:, 0]) / \
+            np.hypot(vel[:, 0], vel[:, 1])**3
+        # d grows along (dx, dy), which lies on one fixed side of (sx, sy)
+        side = np.sign(np.median(self.sx * self.dy - self.sy * self.dx))
+        self.table = np.array([pos[:, 0], pos[:, 1], yaw, k,
+                               -side * np.sin(yaw), side * np.cos(yaw)])
+
+    def _table_idx(self, s):
+        u = self.wrap_s(s) / self.resolution
+        last = self.table.shape[1] - 2
+        if np.ndim(u) == 0:
+            i = min(max(int(math.floor(u)), 0), last)
+        else:
+            i = np.clip(np.floor(u), 0, last).astype(int)
+        return i, u - i
+
+    def to_pose(self, s, d):
+        i, f = self._table_idx(s)
+        if np.ndim(i) == 0:
+            # single lookups read one row of the table
+            a, b = self.table.T[i], self.table.T[i + 1]
+            x, y, yaw, _, nx, ny = (a + (b - a) * f).tolist()
+        else:
+            x, y, yaw, _, nx, ny = \
+                self.table[:, i] * (1 - f) + self.table[:, i + 1] * f
+        yaw = (yaw + math.pi) % (2 * math.pi) - math.pi
+        return x + nx * d, y + ny * d, yaw
+
+    def to_frenet_many(self, x, y):
+        """
+        Projects Cartesian points onto the spline, the exact inverse of
+        to_pose. Between two table samples to_pose is bilinear in the
+        sample fraction f and d, so each table cell near the polyline
+        projection is solved in closed form: the cell whose f lies in
+        [0, 1] with the smallest |d| wins. Points with no such cell keep
+        the polyline projection.
+        """
+        px = np.asarray(x, dtype=float).ravel()
+        py = np.asarray(y, dtype=float).ravel()
+        s0, d0 = Route.to_frenet_many(self, px, py)
+        # the polyline s is off by the chord error and the lateral offset
+        # times the heading difference, a few meters at most
+        reach = int(math.ceil(3. / self.resolution))
+        cells = self.table.shape[1] - 1
+        i = self._table_idx(s0)[0][:, np.newaxis] + \
+            np.arange(-reach, reach + 1)
+        i = i % cells if self.is_loop else np.clip(i, 0, cells - 1)
+        x0, y0, _, _, nx0, ny0 = self.table[:, i]
+        x1, y1, _, _, nx1, ny1 = self.table[:, i + 1]
+        qx, qy = px[:, np.newaxis] - x0, py[:, np.newaxis] - y0
+        px_, py_, mx, my = x1 - x0, y1 - y0, nx1 - nx0, ny1 - ny0
+
+        # cross(q - n0 d, dP + dn d) = 0 is quadratic in d, the root near
+        # the linear solution is taken in its cancellation free form
+        a2 = -(nx0 * my - ny0 * mx)
+        a1 = (qx * my - qy * mx) - (nx0 * py_ - ny0 * px_)
+        a0 = qx * py_ - qy * px_
+        with np.errstate(divide='ignore', invalid='ignore'):
+            root = np.sqrt(a1**2 - 4 * a2 * a0)
+            d = -2 * a0 / (a1 + np.where(a1 < 0, -root, root))
+            wx, wy = px_ + mx * d, py_ + my * d
+            f = ((qx - nx0 * d) * wx + (qy - ny0 * d) * wy) / \
+                (wx**2 + wy**2)
+            inside = (f >= -1e-9) & (f <= 1 + 1e-9)
+        dist = np.where(inside, np.abs(d), np.inf)
+        best = np.argmin(dist, axis=1)
+        rows = np.arange(len(px))
+        found = np.isfinite(dist[rows, best])
+        s = np.where(found, (i[rows, best] + f[rows, best]) *
+                     self.resolution, s0)
+        return self.wrap_s(s), np.where(found, d[rows, best], d0)
+
+    def get_window(self, s0, s1):
+        """
+        Table samples covering s0 <= s <= s1 in the layout of the waypoint
+        fields, s continues past length across the seam of a loop.
+        """
+        s = np.arange(math.floor(s0 / self.resolution),
+                      math.ceil(s1 / self.resolution) + 1) * self.resolution
+        if not self.is_loop:
+            s = s[(s >= 0) & (s <= self.length)]
+        return self._sample_fields(s)
+
+    def edge_samples(self, is_loop=True):
+        s = np.arange(self.table.shape[1]) * self.resolution
+        if is_loop and self.is_loop:
+            s = np.append(s[s < self.length], self.length)
+        fields = self._sample_fields(s)
+        return s, fields[0], fields[1], fields[3], fields[4]
+
+    def _sample_fields(self, s):
+        """
+        (len(FIELDS), K) rows of the spline at s.
+        """
+        x, y, yaw = self.to_pose_many(s, np.zeros(len(s)))
+        i, f = self._table_idx(s)
+        nx, ny = self.table[4:, i] * (1 - f) + self.table[4:, i + 1] * f
+        return np.array([x, y, s, nx, ny, np.cos(yaw), np.sin(yaw), yaw])
+
+    def get_curvature(self, s):
+        i, f = self._table_idx(s)
+        return self.table[3, i] * (1 - f) + self.table[3, i + 1] * f
+
+    def memory_per_km(self):
+        """
+        Bytes of lookup table per km of route.
+        """
+        return self.table.nbytes / (self.length / 1000.)
+
+
+class TiledRoute(Route):
+    """
+    Route for maps too large to hold in memory. Waypoints stay in the
+    memory-mapped binary route file and are copied out in tiles of
+    tile_length meters of s when a query needs them, at most max_tiles of
+    them are kept and the least recently used is evicted first. to_pose,
+    get_idx and get_window only touch the tiles around the queried s, so
+    their cost and memory do not depend on the route length. Other
+    methods fall back to the mapped arrays.
+
+    Read a .route file (see route_format) to keep memory constant from
+    the start, a CSV is parsed in memory, once when read with cache.
+    """
+
+    def __init__(self, lane_width=3.5, lane_num=3, tile_length=1000.,
+                 max_tiles=8):
+        self.tile_length = tile_length
+        self.max_tiles = max_tiles
+        self.hits = 0
+        self.misses = 0
+        Route.__init__(self, lane_width, lane_num)
+
+    def set_data(self, data):
+        Route.set_data(self, data)
+        self.tiles = collections.OrderedDict()
+        self._tile_start = None
+
+    def tile_bounds(self):
+        """
+        First waypoint index of every tile, plus the waypoint count. Tile k
+        owns the waypoints with k * tile_length <= s < (k + 1) * tile_length.
+        Found by binary search, so only a few pages per tile are read.
+        """
+        if self._tile_start is None:
+            count = int(self.s[-1] // self.tile_length) + 1 \
+                if len(self.s) else 1
+            self._tile_start = np.searchsorted(
+                self.s, np.arange(count + 1) * self.tile_length)
+        return self._tile_start
+
+    def get_tile(self, k):
+        """
+        Returns (first index, waypoint array) of tile k. The array also
+        holds the waypoints just before and after the tile.
+        """
+        tile = self.tiles.pop(k, None)
+        if tile is None:
+            self.misses += 1
+            start = self.tile_bounds()
+            lo = max(start[k] - 1, 0)
+            hi = min(start[k + 1] + 1, len(self.s))
+            tile = (lo, np.array(self.data[:, lo:hi]))
+            if len(self.tiles) >= self.max_tiles:
+                self.tiles.popitem(last=False)
+        else:
+            self.hits += 1
+        self.tiles[k] = tile
+        return tile
+
+    def memory(self):
+        """
+        Bytes of waypoints currently held in tiles.
+        """
+        return sum(tile.nbytes for _, tile in self.tiles.values())
+
+    def get_idx(self, s):
+        return self.locate(s)[0]
+
+    def locate(self, s):
+        """
+        Returns the index of the waypoint at or before s and its fields, a
+        (len(FIELDS),) + s.shape array, looking into each tile once.
+        """
+        last = len(self.tile_bounds()) - 2
+        if np.ndim(s) == 0:
+            lo, tile = self.get_tile(min(max(int(s // self.tile_length), 0),
+                                         last))
+            i = max(int(np.searchsorted(tile[2], s, side='right')) - 1, 0)
+            return lo + i, tile[:, i]
+        s = np.asarray(s, dtype=float)
+        k = np.clip(np.floor(s / self.tile_length), 0, last).astype(int)
+        if s.size and k.min() == k.max():
+            lo, tile = self.get_tile(k.flat[0])
+            i = np.maximum(np.searchsorted(tile[2], s, side='right') - 1, 0)
+            return lo + i, tile[:, i]
+        idx = np.empty(s.shape, dtype=np.int64)
+        rows = np.empty((len(self.FIELDS),) + s.shape)
+        for tile_k in np.unique(k):
+            mask = k == tile_k
+            lo, tile = self.get_tile(tile_k)
+            i = np.maximum(
+                np.searchsorted(tile[2], s[mask], side='right') - 1, 0)
+            idx[mask] = lo + i
+            rows[:, mask] = tile[:, i]
+        return idx, rows
+
+    def get_rows(self, idx):
+        """
+        Waypoint fields at global indices, a (len(FIELDS),) + idx.shape
+        array read from the tiles.
+        """
+        start = self.tile_bounds()
+        if np.ndim(idx) == 0:
+            lo, tile = self.get_tile(
+                np.searchsorted(start, idx, side='right') - 1)
+            return tile[:, idx - lo]
+        idx = np.asarray(idx)
+        k = np.searchsorted(start, idx, side='right') - 1
+        rows = np.empty((len(self.FIELDS),) + idx.shape)
+        for tile_k in np.unique(k):
+            mask = k == tile_k
+            lo, tile = self.get_tile(tile_k)
+            rows[:, mask] = tile[:, idx[mask] - lo]
+        return rows
+
+    def to_pose(self, s, d):
+        x, y, s0, dx, dy, sx, sy, yaw = self.locate(s)[1]
+        ds = s - s0
+        return x + dx * d + sx * ds, y + dy * d + sy * ds, yaw
+
+    def _span(self, s0, s1):
+        i0 = max(int(self.get_idx(s0)), 0)
+        i1 = min(int(self.get_idx(s1)) + 2, len(self.s))
+        return self.get_rows(np.arange(i0, i1))
+
+
+def _spline_moments(knots, points, periodic):
+    """
+    Second derivatives at the knots of a cubic spline through (N, k)
+    points, periodic (first and last point equal) or natural.
+    """
+    h = np.diff(knots)[:, np.newaxis]
+    slope = np.diff(points, axis=0) / h
+    if periodic:
+        # unknowns M_0..M_{n-1}, M_n == M_0
+        r = 6 * (slope - np.roll(slope, 1, axis=0))
+        lower = np.roll(h, 1, axis=0)[:, 0]
+        diag = 2 * (lower + h[:, 0])
+        M = _solve_cyclic(lower, diag, h[:, 0], r)
+        return np.vstack([M, M[:1]])
+
+    r = 6 * (slope[1:] - slope[:-1])
+    M = np.zeros(points.shape)
+    if len(r):
+        M[1:-1] = _solve_tridiagonal(h[:-1, 0], 2 * (h[:-1, 0] + h[1:, 0]),
+                                     h[1:, 0], r)
+    return M
+
+
+def _solve_tridiagonal(lower, diag, upper, r):
+    """
+    Thomas algorithm, lower[0] and upper[-1] are ignored.
+    """
+    n = len(diag)
+    c = np.zeros(n)
+    x = np.zeros(r.shape)
+    c[0] = upper[0] / diag[0]
+    x[0] = r[0] / diag[0]
+    for i in range(1, n):
+        m = diag[i] - lower[i] * c[i - 1]
+        c[i] = upper[i] / m
+        x[i] = (r[i] - lower[i] * x[i - 1]) / m
+    for i in range(n - 2, -1, -1):
+        x[i] -= c[i] * x[i + 1]
+    return x
+
+
+def _solve_cyclic(lower, diag, upper, r):
+    """
+    Tridiagonal solve with corner terms lower[0] (row 0, last column) and
+    upper[-1] (last row, column 0), using Sherman-Morrison.
+    """
+    gamma = -diag[0]
+    diag = diag.copy()
+    diag[0] -= gamma
+    diag[-1] -= upper[-1] * lower[0] / gamma
+    x = _solve_tridiagonal(lower, diag, upper, r)
+    u = np.zeros(len(diag))
+    u[0], u[-1] = gamma, upper[-1]
+    z = _solve_tridiagonal(lower, diag, upper, u)
+    fact = (x[0] + lower[0] * x[-1] / gamma) / \
+        (1 + z[0] + lower[0] * z[-1] / gamma)
+    return x - np.outer(z, fact).reshape(x.shape)
+
+
 class Map:
-    def __init__(self, axes, lane_width=3.5, lane_num=3):
-        self.route = Route(lane_width, lane_num)
+    def __init__(self, axes=None, lane_width=3.5, lane_num=3,
+                 spline_resolution=None, tile_length=None):
+        if spline_resolution:
+            self.route = SplineRoute(lane_width, lane_num, spline_resolution)
+        elif tile_length:
+            self.route = TiledRoute(lane_width, lane_num, tile_length)
+        else:
+            self.route = Route(lane_width, lane_num)
         self.map = []
-        for i in range(lane_num + 1):
-            self.map.append(Line2D([], [], 1, linestyle='-.', color='black'))
+        self._edges = None
+        if axes:
+            self.add_to(axes)
+
+    def add_to(self, axes):
+        """
+        Creates the lane edge artists, matplotlib is only imported here.
+        """
+        from matplotlib.lines import Line2D
+        self.map = []
+        for i in range(self.route.lane_num + 1):
+            self.map.append(Line2D([], [], linewidth=1, linestyle='-.',
+                                   color='black'))
             axes.add_line(self.map[i])
         self.map[0].set_linestyle('-')
         self.map[-1].set_linestyle('-')
 
-    def read(self, file, is_loop=True):
-        self.route.read(file, is_loop)
+    def read(self, file, is_loop=True, cache=False):
+        self.route.read(file, is_loop, cache)
+
+    def draw(self, is_loop=True, s_window=None):
+        """
+        Draws the lane edges, only along s_window = (s0, s1) when given.
+        The edges are computed once and sliced to the window by binary
+        search, tiled routes build just the window from their tiles.
+        """
+        if s_window is not None and isinstance(self.route, TiledRoute):
+            x, y, _, dx, dy = self.route.get_window(*s_window)[:5]
+            for lane_edge in range(self.route.lane_num + 1):
+                offset = self.route.lane_width * lane_edge
+                self.map[lane_edge].set_data(x + dx * offset,
+                                             y + dy * offset)
+            return self.map
 
-    def draw(self, is_loop=True):
+        s, edges = self.edge_geometry(is_loop)
+        if s_window is not None:
+            edges = edges[:, :, self._window_idx(s, s_window, is_loop)]
         for lane_edge in range(self.route.lane_num + 1):
-            route_x = []
-            route_y = []
-            for i in range(len(self.route.s)):
-                x, y = self.route.get_edge_xy(i, lane_edge)
-                route_x.append(x)
-                route_y.append(y)
-
-            if is_loop:
-                route_x.append(route_x[0])
-                route_y.append(route_y[0])
-            self.map[lane_edge].set_data(route_x, route_y)
+            self.map[lane_edge].set_data(edges[lane_edge, 0],
+                                         edges[lane_edge, 1])
         return self.map
 
+    def edge_geometry(self, is_loop=True):
+        """
+        Returns the s of Route.edge_samples and the (lane_num + 1, 2, K)
+        x, y of every lane edge, cached until the route data changes.
+        Loops repeat the first sample at s = length.
+        """
+        route = self.route
+        if self._edges is None or self._edges[0] is not route.data or \
+                self._edges[1] != is_loop:
+            s, x, y, dx, dy = route.edge_samples(is_loop)
+            offset = route.lane_width * \
+                np.arange(route.lane_num + 1)[:, np.newaxis]
+            edges = np.stack([x + dx * offset, y + dy * offset], axis=1)
+            self._edges = (route.data, is_loop, s, edges)
+        return self._edges[2:]
+
+    def _window_idx(self, s, s_window, is_loop):
+        """
+        Indices into the edge geometry from the waypoint at or before s0 to
+        the one after s1, continuing across the seam of a loop.
+        """
+        s0, s1 = s_window
+
+        def span(a, b):
+            i0 = max(np.searchsorted(s, a, side='right') - 1, 0)
+            i1 = min(np.searchsorted(s, b) + 1, len(s))
+            return np.arange(i0, i1)
+
+        if not is_loop:
+            return span(s0, s1)
+        length = s[-1]
+        pieces = []
+        base = math.floor(s0 / length) * length
+        while base <= s1:
+            pieces.append(span(max(s0 - base, 0), min(s1 - base, length)))
+            base += length
+        return np.concatenate(pieces)
 
 def main():
+    import matplotlib.pyplot as plt
+    from matplotlib.lines import Line2D
     print("Test Map class")
     fig1 = plt.figure()
     ax1 = fig1.add_subplot(111, aspect='equal')
 
     map1 = Map(ax1)
     map1.read("highway_map.csv")
+
+    # in-lane points must come back to the same pose through to_frenet
+    spline = SplineRoute()
+    spline.read("highway_map.csv")
+    for route in (map1.route, spline):
+        rng = np.random.RandomState(0)
+        s = rng.uniform(0, route.length, 20000)
+        d = rng.uniform(0, route.lane_width * route.lane_num, 20000)
+        x, y, _ = route.to_pose_many(s, d)
+        x2, y2, _ = route.to_pose_many(*route.to_frenet_many(x, y))
+        error = np.hypot(x2 - x, y2 - y)
+        print("%s frenet round trip: %d of %d points off, max error %.2e m"
+              % (type(route).__name__, np.sum(error > 1e-6), len(s),
+                 error.max()))
     # print(map1.route.x)
     # print(map1.route.y)
     map1.draw(is_loop=False)
@@ -141,7 +798,7 @@ def main():
         x, y = map1.route.get_center_xy(i)
         testx.append(x)
         testy.append(y)
-    test = Line2D(testx, testy, 1, linestyle='-.', color='red')
+    test = Line2D(testx, testy, linewidth=1, linestyle='-.', color='red')
     ax1.add_line(test)
 
     for i in range(0, len(map1.route.s)):
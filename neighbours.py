@@ -0,0 +1,209 @@
+import time
+import numpy as np
+
+
+class NeighbourIndex:
+    """
+    Vehicles sorted by s within each lane, for batched lead, follower and
+    range queries by binary search. Keys are lane * span + s on one sorted
+    axis, so every query, whatever its lane, is one searchsorted.
+
+    update() is called once per tick. The order of the previous tick is
+    reused: the keys taken in that order are nearly sorted already, and a
+    stable (merge) sort of nearly sorted keys runs in about linear time.
+    On loop routes s is wrapped and lanes are searched around the seam.
+    Query results hold vehicle indices into the arrays given to update,
+    -1 where there is no vehicle.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.order = np.zeros(0, dtype=np.int64)
+        self.update(np.zeros(0), np.zeros(0, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.order)
+
+    def update(self, s, lane):
+        """
+        Indexes vehicles at s in lane, (N,) arrays.
+        """
+        s = np.asarray(s, dtype=float)
+        lane = np.asarray(lane, dtype=np.int64)
+        self.is_loop = self.route.is_loop
+        if self.is_loop:
+            self.origin, self.extent = 0., self.route.length
+        elif len(s):
+            self.origin, self.extent = s.min(), np.ptp(s)
+        else:
+            self.origin, self.extent = 0., 0.
+        # queries are clipped to [-1, extent + 1], so lanes never overlap
+        self.span = self.extent + 4.
+        s = self._wrap_s(s)
+        keys = lane * self.span + (s - self.origin)
+
+        if len(self.order) == len(s):
+            order = self.order[np.argsort(keys[self.order], kind='stable')]
+        else:
+            order = np.argsort(keys, kind='stable')
+        self.order = order
+        self.keys = keys[order]
+        self.s = s[order]
+        # first position of each lane from the lowest - 1 to the highest
+        # + 2, queries in lanes outside clip to the empty ones at the ends
+        lanes = lane[order]
+        self.min_lane = lanes[0] - 1 if len(lanes) else 0
+        self.lane_start = np.searchsorted(
+            lanes, np.arange(self.min_lane, self.min_lane + 4 +
+                             (lanes[-1] - lanes[0] if len(lanes) else 0)))
+
+    def _wrap_s(self, s):
+        s = np.asarray(s, dtype=float)
+        if not self.is_loop:
+            return s
+        return s - np.floor(s / self.extent) * self.extent
+
+    def _key(self, s, lane):
+        return lane * self.span + np.clip(s - self.origin, -1,
+                                          self.extent + 1)
+
+    def _lane_bounds(self, lane):
+        row = np.clip(lane - self.min_lane, 0, len(self.lane_start) - 2)
+        return self.lane_start[row], self.lane_start[row + 1]
+
+    def lead(self, s, lane, exclude=None):
+        """
+        Nearest vehicle strictly ahead of each query (s, lane) in that
+        lane, skipping vehicle exclude (e.g. the querying vehicle itself).
+        Returns (vehicle, ds), ds is inf where there is none.
+        """
+        return self._nearest(s, lane, exclude, ahead=True)
+
+    def follower(self, s, lane, exclude=None):
+        """
+        Nearest vehicle strictly behind each query, see lead. Returns
+        (vehicle, ds) with ds > 0 the distance behind.
+        """
+        return self._nearest(s, lane, exclude, ahead=False)
+
+    def _nearest(self, s, lane, exclude, ahead):
+        lane = np.asarray(lane, dtype=np.int64)
+        s = self._wrap_s(s)
+        key = self._key(s, lane)
+        key, s, lane = np.broadcast_arrays(key, s, lane)
+        if not len(self.order):
+            return np.full(s.shape, -1), np.full(s.shape, np.inf)
+        lo, hi = self._lane_bounds(lane)
+        count = hi - lo
+        if ahead:
+            pos = np.searchsorted(self.keys, key, side='right') - lo
+        else:
+            pos = np.searchsorted(self.keys, key, side='left') - lo - 1
+        pos, laps = self._wrap(pos, count)
+        if exclude is not None:
+            step = 1 if ahead else -1
+            hit = (count > 0) & \
+                (self.order[np.clip(lo + pos, 0, len(self) - 1)] == exclude)
+            next_pos, next_laps = self._wrap(pos + step, count)
+            pos = np.where(hit, next_pos, pos)
+            # a lap back to the excluded vehicle means it is alone
+            laps = np.where(hit, laps.astype(int) + next_laps, laps)
+            count = np.where(hit & (count == 1), 0, count)
+
+        found = count > 0
+        if not self.is_loop:
+            found &= laps == 0
+        else:
+            found &= laps < 2
+        idx = np.clip(lo + pos, 0, len(self) - 1)
+        ds = (self.s[idx] - s) if ahead else (s - self.s[idx])
+        ds = ds + laps * self.extent
+        return np.where(found, self.order[idx], -1), \
+            np.where(found, ds, np.inf)
+
+    def _wrap(self, pos, count):
+        """
+        Wraps lane positions in [-1, count] into [0, count), returns them
+        and whether the lane was wrapped around.
+        """
+        under, over = pos < 0, pos >= count
+        return np.where(under, pos + count, np.where(over, pos - count, pos)), \
+            under | over
+
+    def within(self, s, lane, behind, ahead, exclude=None):
+        """
+        All vehicles of each query's lane with s - behind <= s' <= s + ahead
+        (around the seam on loops, behind + ahead below the route length).
+        Returns flat (query, vehicle, ds) arrays, ds = s' - s.
+        """
+        lane = np.asarray(lane, dtype=np.int64)
+        s, lane = np.broadcast_arrays(
+            self._wrap_s(s), lane)
+        shifts = (0., -self.extent, self.extent) if self.is_loop \
+            else (0.,)
+        queries, vehicles, offsets = [], [], []
+        for shift in shifts:
+            # vehicle at s' + shift lies in the window
+            lo = self._key(s - behind - shift, lane)
+            hi = self._key(s + ahead - shift, lane)
+            first = np.searchsorted(self.keys, lo, side='left')
+            last = np.searchsorted(self.keys, hi, side='right')
+            counts = np.maximum(last - first, 0)
+            counts, first = counts.ravel(), first.ravel()
+            query = np.repeat(np.arange(s.size), counts)
+            # positions first .. last - 1 of every query, concatenated
+            pos = np.repeat(first - np.cumsum(counts) + counts, counts) + \
+                np.arange(counts.sum())
+            queries.append(query)
+            vehicles.append(pos)
+            offsets.append(np.full(len(pos), shift))
+        query = np.concatenate(queries)
+        pos = np.concatenate(vehicles)
+        ds = self.s[pos] + np.concatenate(offsets) - s.ravel()[query]
+        vehicle = self.order[pos]
+        if exclude is not None:
+            keep = vehicle != np.broadcast_to(exclude, s.shape).ravel()[query]
+            query, vehicle, ds = query[keep], vehicle[keep], ds[keep]
+        return query, vehicle, ds
+
+
+def main():
+    from map import Route
+    print("Test NeighbourIndex class")
+    route = Route()
+    route.read("highway_map.csv")
+    rng = np.random.RandomState(0)
+    n = 10000
+    s = rng.uniform(0, route.length, n)
+    lane = rng.randint(0, route.lane_num, n)
+    v = rng.uniform(15, 25, n)
+
+    index = NeighbourIndex(route)
+    full, incremental = 0., 0.
+    for _ in range(100):
+        s += v * 0.1
+        start = time.time()
+        np.argsort(lane * (route.length + 4) + route.wrap_s(s),
+                   kind='stable')
+        full += time.time() - start
+        start = time.time()
+        index.update(s, lane)
+        incremental += time.time() - start
+    print("%d vehicles, update: full sort %.2f ms, incremental %.2f ms" %
+          (n, full * 10, incremental * 10))
+
+    start = time.time()
+    lead, gap = index.lead(s, lane, exclude=np.arange(n))
+    batched = time.time() - start
+    start = time.time()
+    for i in range(100):
+        ahead = route.wrap_s(s[lane == lane[i]] - s[i])
+        ahead[ahead == 0] = np.inf
+        ahead.min()
+    scan = (time.time() - start) / 100 * n
+    print("lead of all %d: batched %.2f ms, per-vehicle scans ~%.0f ms" %
+          (n, batched * 1e3, scan * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import time
+import numpy as np
+
+
+class RecedingHorizonPlanner:
+    """
+    Receding horizon planning with a TrajectoryGenerator and a
+    TrajectoryCost.
+
+    The chosen s and d polynomials are kept between ticks. A re-plan
+    starts ahead steps after the current time, from the position,
+    velocity and acceleration of the kept plan there, so the car executes
+    the unexecuted prefix of the old plan and the stitched path stays
+    continuous up to acceleration. A candidate only depends on its start
+    position through its constant coefficient, so candidates whose
+    displacement, start/end derivatives and T are unchanged since the last
+    plan (within tolerance) reuse their coefficients instead of being
+    solved again. The candidates of the last plan are left in the
+    generator's traj_coefs for drawing.
+    """
+
+    def __init__(self, traj_gen, cost, T=3., dt=0.1, ahead=3,
+                 tolerance=1e-9):
+        self.traj_gen = traj_gen
+        self.cost = cost
+        self.T = T
+        self.dt = dt
+        self.ahead = ahead
+        self.tolerance = tolerance
+        # (start time, (2, 6) s and d coefficients, horizon)
+        self.segments = []
+        self._keys = None
+        self._alphas = None
+        self.solved = 0
+        self.skipped = 0
+
+    def reset(self):
+        self.segments = []
+        self._keys = None
+        self._alphas = None
+
+    def state(self, t):
+        """
+        (2, 3) position, velocity and acceleration of s and d of the
+        stitched plan at time t. Past its horizon a plan goes on at its
+        final speed.
+        """
+        start, coefs, T = self.segments[0]
+        for segment in self.segments[1:]:
+            if segment[0] > t:
+                break
+            start, coefs, T = segment
+        tau = min(t - start, T)
+        powers = tau ** np.arange(6)
+        state = np.array([np.dot(coefs, powers),
+                          np.dot(coefs[:, 1:], np.arange(1, 6) * powers[:5]),
+                          np.dot(coefs[:, 2:], np.array([2, 6, 12, 20]) *
+                                 powers[:4])]).T
+        if t - start > T:
+            state[:, 0] += state[:, 1] * (t - start - T)
+            state[:, 2] = 0
+        return state
+
+    def start_state(self, t, s, v, d):
+        """
+        Returns the time and (2, 3) s and d start states of a re-plan at
+        time t: a few steps ahead on the kept plan, or the car's s, v and
+        d (at rest laterally) when there is none.
+        """
+        if not self.segments:
+            return t, np.array([[s, v, 0.], [d, 0., 0.]])
+        t0 = t + self.ahead * self.dt
+        return t0, self.state(t0)
+
+    def plan(self, t, goals_s, goals_d, s=0., v=0., d=0., obs_s=(),
+             obs_d=(), obs_v=(), T=None):
+        """
+        Plans at time t toward (N, 3) goal states of s and d, relative to
+        the start position: goal positions are displacements from the
+        start s and absolute d. s, v, d are the car's state, only used
+        without a kept plan. T is a scalar or (N,) array of horizons,
+        self.T by default. Returns the index of the chosen candidate.
+        """
+        t0, start = self.start_state(t, s, v, d)
+        return self._plan(t, t0, start, goals_s, goals_d,
+                          self.T if T is None else T, obs_s, obs_d, obs_v)
+
+    def plan_lattice(self, t, s=0., v=0., d=0., obs_s=(), obs_d=(),
+                     obs_v=(), **options):
+        """
+        Plans over TrajectoryGenerator.lattice(route, start_s, start_d,
+        **options) built from the re-plan start state. Returns the index
+        of the chosen candidate and the lattice.
+        """
+        t0, start = self.start_state(t, s, v, d)
+        candidates = self.traj_gen.lattice(self.cost.route, start[0],
+                                           start[1], **options)
+        goals_s = candidates['goal_s'].copy()
+        goals_s[:, 0] -= start[0, 0]
+        best = self._plan(t, t0, start, goals_s, candidates['goal_d'],
+                          candidates['T'], obs_s, obs_d, obs_v)
+        return best, candidates
+
+    def _plan(self, t, t0, start, goals_s, goals_d, T, obs_s, obs_d, obs_v):
+        goals_s = np.asarray(goals_s, dtype=float).reshape(-1, 3)
+        goals_d = np.asarray(goals_d, dtype=float).reshape(-1, 3)
+        n = len(goals_s)
+        if not n:
+            raise ValueError("no candidate goals to plan over")
+        T = np.broadcast_to(np.asarray(T, dtype=float), (n,))
+        # position free boundary conditions of every candidate
+        keys = np.empty((n, 2, 6))
+        keys[:, 0, 0] = goals_s[:, 0]
+        keys[:, 1, 0] = goals_d[:, 0] - start[1, 0]
+        keys[:, :, 1:3] = start[:, 1:]
+        keys[:, 0, 3:5] = goals_s[:, 1:]
+        keys[:, 1, 3:5] = goals_d[:, 1:]
+        keys[:, :, 5] = T[:, None]
+
+        if self._keys is not None and self._keys.shape == keys.shape:
+            changed = (np.abs(keys - self._keys) >
+                       self.tolerance).any(axis=2)
+            alphas = self._alphas
+        else:
+            changed = np.ones((n, 2), dtype=bool)
+            alphas = np.empty((n, 2, 6))
+        for axis in (0, 1):
+            rows = np.flatnonzero(changed[:, axis])
+            if len(rows):
+                key = keys[rows, axis]
+                alphas[rows, axis] = self.traj_gen.jmt_batch(
+                    np.column_stack([np.zeros(len(rows)), key[:, 1:3]]),
+                    key[:, [0, 3, 4]], key[:, 5])
+        self.solved += int(changed.sum())
+        self.skipped += int(changed.size - changed.sum())
+        self._keys, self._alphas = keys, alphas
+
+        coefs = alphas.copy()
+        coefs[:, :, 0] += start[:, 0]
+        best, _, _ = self.cost.best(coefs[:, 0], coefs[:, 1], T,
+                                    obs_s, obs_d, obs_v, self.dt)
+        # the old plan is still executed until t0
+        self.segments = [segment for i, segment in enumerate(self.segments)
+                         if i + 1 == len(self.segments) or
+                         self.segments[i + 1][0] > t] + \
+            [(t0, coefs[best].copy(), T[best])]
+
+        traj_gen = self.traj_gen
+        traj_gen.clear()
+        traj_gen.traj_coefs.extend([c[0], c[1]] for c in coefs)
+        traj_gen.t.extend(T.tolist())
+        return best
+
+    def follow(self, car, t):
+        """
+        Moves a Car on a route to the plan at time t. The plan's s keeps
+        growing over laps of a loop, the car's s is wrapped.
+        """
+        (s, car.v, _), (car.d, _, _) = self.state(t).tolist()
+        car.s = car.route.wrap_s(s)
+        car.x, car.y, car.yaw = car.route.to_pose(car.s, car.d)
+        car.route_idx = car.route.get_idx(car.s)
+
+
+def main():
+    from car import Car
+    from map import Route
+    from trajectory_cost import TrajectoryCost
+    from trajectory_generation import TrajectoryGenerator
+    print("Test RecedingHorizonPlanner class")
+    route = Route()
+    route.read("highway_map.csv")
+    traj_gen = TrajectoryGenerator()
+    cost = TrajectoryCost(route, traj_gen=traj_gen)
+    speeds = np.array([16., 18., 20.])
+    lanes = route.to_d_many(np.arange(route.lane_num))
+    T, dt, ticks = 3., 0.1, 600
+
+    def goals(v):
+        goal_v = np.repeat(speeds, len(lanes))
+        goals_s = np.column_stack([(v + goal_v) / 2 * T, goal_v,
+                                   np.zeros(len(goal_v))])
+        goals_d = np.column_stack([np.tile(lanes, len(speeds)),
+                                   np.zeros((len(goal_v), 2))])
+        return goals_s, goals_d
+
+    # re-planning from the car each tick, as test_traj_gen did, executing
+    # the first dt of every plan
+    car = Car()
+    car.set_route(route, s=0, lane=1)
+    car.v = 10.
+    jumps, solves, acc = [], 0, 0.
+    start = time.time()
+    for tick in range(ticks):
+        goals_s, goals_d = goals(car.v)
+        goals_s[:, 0] += car.s
+        coefs_s = traj_gen.jmt_batch(np.tile([car.s, car.v, 0.],
+                                             (len(goals_s), 1)), goals_s, T)
+        coefs_d = traj_gen.jmt_batch(np.tile([car.d, 0., 0.],
+                                             (len(goals_d), 1)), goals_d, T)
+        solves += 2 * len(goals_s)
+        best, _, _ = cost.best(coefs_s, coefs_d, T)
+        # the new plan starts at zero acceleration
+        jumps.append(abs(acc))
+        powers = dt ** np.arange(6)
+        car.s, car.d = np.dot(coefs_s[best], powers), \
+            np.dot(coefs_d[best], powers)
+        car.v = np.dot(coefs_s[best, 1:], np.arange(1, 6) * powers[:5])
+        acc = np.dot(coefs_s[best, 2:],
+                     np.array([2, 6, 12, 20]) * powers[:4])
+    print("re-plan from car: %.0f us/tick, %.1f solves/tick, "
+          "max acceleration jump at re-plan %.3f m/s^2" %
+          ((time.time() - start) / ticks * 1e6, solves / float(ticks),
+           max(jumps)))
+
+    planner = RecedingHorizonPlanner(traj_gen, cost, T, dt)
+    car.set_route(route, s=0, lane=1)
+    car.v = 10.
+    jumps = []
+    start = time.time()
+    for tick in range(ticks):
+        goals_s, goals_d = goals(car.v)
+        t = tick * dt
+        before = planner.state(t + planner.ahead * dt)[0, 2] \
+            if planner.segments else 0.
+        planner.plan(t, goals_s, goals_d, car.s, car.v, car.d)
+        jumps.append(abs(before - 2 * planner.segments[-1][1][0, 2]))
+        planner.follow(car, t + dt)
+    print("receding horizon: %.0f us/tick, %.1f solves/tick, "
+          "max acceleration jump at re-plan %.3f m/s^2, %.0f%% skipped" %
+          ((time.time() - start) / ticks * 1e6,
+           planner.solved / float(ticks), max(jumps),
+           100. * planner.skipped / (planner.solved + planner.skipped)))
+
+    # every target speed above the limit and too far for max_acc: the
+    # lattice falls back to keeping the lane at the limited speed
+    planner.reset()
+    v = car.v
+    for tick in range(ticks):
+        t = tick * dt
+        best, candidates = planner.plan_lattice(
+            t, car.s, car.v, car.d, speeds=(30., 35.), speed_limits=(0., 15.),
+            max_acc=.5)
+        planner.follow(car, t + dt)
+    print("fully pruned lattice: %d candidate, lane %d, %.1f -> %.1f m/s" %
+          (len(candidates), candidates['lane'][best], v, car.v))
+
+if __name__ == "__main__":
+    main()
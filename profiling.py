@@ -0,0 +1,274 @@
+import csv
+import functools
+import json
+import math
+import time
+
+
+class Histogram:
+    """
+    Durations in log spaced buckets, BUCKETS_PER_OCTAVE per doubling from
+    MIN seconds, so recording is a log and an increment and quantiles are
+    within a few percent whatever the spread of the samples.
+    """
+    MIN = 1e-7
+    BUCKETS_PER_OCTAVE = 16
+
+    def __init__(self):
+        self._scale = self.BUCKETS_PER_OCTAVE / math.log(2)
+        self.clear()
+
+    def clear(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = 0.
+
+    def record(self, seconds):
+        bucket = int(math.log(max(seconds, self.MIN) / self.MIN) *
+                     self._scale)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        Geometric middle of the bucket holding quantile q, clipped to the
+        recorded range.
+        """
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                value = self.MIN * math.exp((bucket + 0.5) / self._scale)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'total': self.total,
+                'mean': self.total / self.count if self.count else math.nan,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95),
+                'p99': self.quantile(0.99),
+                'max': self.max if self.count else math.nan}
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+# (module, class, method) of the stages instrument_hot_paths times
+HOT_PATHS = [
+    ('car', 'Car', 'follow_route'),
+    ('trajectory_generation', 'TrajectoryGenerator', 'generate'),
+    ('trajectory_generation', 'TrajectoryGenerator', 'draw'),
+    ('map', 'Route', 'to_pose'),
+    ('map', 'SplineRoute', 'to_pose'),
+    ('map', 'TiledRoute', 'to_pose'),
+    ('map', 'Map', 'draw'),
+    ('planner', 'RecedingHorizonPlanner', 'plan'),
+    ('planner', 'RecedingHorizonPlanner', 'plan_lattice'),
+]
+
+
+class Profiler:
+    """
+    Per stage timing histograms.
+
+    Methods are timed by patching a timing wrapper into their class with
+    instrument while enabled, disable puts the originals back and enable
+    patches them in again, so a disabled profiler costs nothing on the
+    hot path. timer(stage) is a context manager for code blocks, a shared
+    no-op while disabled. Results are exported with to_json or to_csv at
+    the end of a run, one row per stage with count, total, mean, p50, p95,
+    p99 and max seconds.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self._instrumented = []
+        self._patched = []
+
+    def histogram(self, stage):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        return histogram
+
+    def timer(self, stage):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.histogram(stage))
+
+    def timed(self, stage=None):
+        """
+        Decorator timing every call of a function while enabled.
+        """
+        def decorate(function):
+            name = stage or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.histogram(name).record(time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def instrument(self, owner, method, stage=None):
+        """
+        Times owner.method (a class or any object) under stage, by default
+        'Class.method'. Only methods defined on owner itself are patched,
+        and only while enabled: enable and disable install and remove the
+        wrappers of every instrumented method.
+        """
+        name = stage or '%s.%s' % (getattr(owner, '__name__',
+                                           type(owner).__name__), method)
+        if method not in owner.__dict__:
+            raise KeyError(name)
+        self._instrumented.append((owner, method, name))
+        if self.enabled:
+            self._patch(owner, method, name)
+
+    def _patch(self, owner, method, name):
+        original = owner.__dict__[method]
+        histogram = self.histogram(name)
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter() - start)
+        setattr(owner, method, wrapper)
+        self._patched.append((owner, method, original))
+
+    def instrument_hot_paths(self):
+        import importlib
+        for module, cls, method in HOT_PATHS:
+            self.instrument(getattr(importlib.import_module(module), cls),
+                            method)
+
+    def enable(self):
+        """
+        Starts timing and patches every instrumented method.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        for owner, method, name in self._instrumented:
+            self._patch(owner, method, name)
+
+    def disable(self):
+        """
+        Stops timing and removes every patched wrapper, instrumented
+        methods are patched again by enable.
+        """
+        self.enabled = False
+        while self._patched:
+            owner, method, original = self._patched.pop()
+            setattr(owner, method, original)
+
+    def reset(self):
+        for histogram in self.stages.values():
+            histogram.clear()
+
+    def summary(self):
+        return dict((stage, histogram.summary())
+                    for stage, histogram in self.stages.items()
+                    if histogram.count)
+
+    def report(self):
+        lines = ['%-32s %8s %10s %10s %10s %10s' %
+                 ('stage', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'total s')]
+        for stage, row in sorted(self.summary().items(),
+                                 key=lambda item: -item[1]['total']):
+            lines.append('%-32s %8d %10.3f %10.3f %10.3f %10.3f' %
+                         (stage, row['count'], row['p50'] * 1e3,
+                          row['p95'] * 1e3, row['p99'] * 1e3, row['total']))
+        return '\n'.join(lines)
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+    def to_csv(self, path):
+        fields = ['stage', 'count', 'total', 'mean', 'p50', 'p95', 'p99',
+                  'max']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            for stage, row in sorted(self.summary().items()):
+                row['stage'] = stage
+                writer.writerow(row)
+
+
+def main():
+    import numpy as np
+    from car import Car
+    from map import Route
+    print("Test Profiler class")
+    route = Route()
+    route.read("highway_map.csv")
+    car = Car()
+    car.set_route(route, s=0, lane=1)
+    car.v = 20
+
+    profiler = Profiler(enabled=False)
+    profiler.instrument_hot_paths()
+    for enabled in (False, True):
+        if enabled:
+            profiler.enable()
+        start = time.time()
+        for _ in range(20000):
+            with profiler.timer('tick'):
+                car.follow_route()
+        print("%-8s %.2f us per tick" %
+              ('profiled' if enabled else 'plain',
+               (time.time() - start) / 20000 * 1e6))
+    profiler.disable()
+    print(profiler.report())
+
+    histogram = Histogram()
+    samples = np.random.RandomState(0).lognormal(-7, 1, 100000)
+    for sample in samples:
+        histogram.record(sample)
+    print("p50 %.3e (exact %.3e), p99 %.3e (exact %.3e)" %
+          (histogram.quantile(0.5), np.percentile(samples, 50),
+           histogram.quantile(0.99), np.percentile(samples, 99)))
+
+
+if __name__ == "__main__":
+    main()
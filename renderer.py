@@ -0,0 +1,193 @@
+import collections
+import time
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from matplotlib.transforms import Affine2D
+from car import outlines
+
+
+class LinePool:
+    """
+    Line2D artists reused across frames: each frame the first n lines get
+    new data and the rest are hidden, lines are only created when a frame
+    needs more than ever before.
+    """
+
+    def __init__(self, axes, transform, **style):
+        self.axes = axes
+        self.transform = transform
+        self.style = style
+        self.lines = []
+
+    def set_data(self, xs, ys):
+        """
+        xs, ys are sequences of 1D arrays, or (N, K) arrays.
+        """
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            if i == len(self.lines):
+                line = Line2D([], [], transform=self.transform,
+                              animated=True, **self.style)
+                self.axes.add_line(line)
+                self.lines.append(line)
+            self.lines[i].set_data(x, y)
+            self.lines[i].set_visible(True)
+        for line in self.lines[len(xs):]:
+            line.set_visible(False)
+
+
+class Renderer:
+    """
+    Blitted rendering of a map, cars and candidate trajectories.
+
+    The axes limits never change: the camera is a translation in the
+    transform of every animated artist, so the background (axes, grid)
+    is rendered once and cached, and a frame restores it and draws only
+    the animated artists. Cars are one LineCollection, trajectories a
+    LinePool. The cache is refreshed whenever the canvas is fully
+    redrawn, e.g. on resize. Coordinates on the axes are relative to the
+    camera.
+    """
+
+    def __init__(self, axes=None, view_x=80, fps_window=60):
+        if axes is None:
+            import matplotlib.pyplot as plt
+            axes = plt.figure(figsize=(12, 8)).add_subplot(111)
+        self.axes = axes
+        self.canvas = axes.figure.canvas
+        self.view_x = view_x
+        axes.set_aspect('equal')
+        axes.set_xlim(-view_x, view_x)
+        axes.set_ylim(-view_x / 2., view_x / 2.)
+        axes.grid(True, color='grey', linestyle=':')
+
+        self.camera = Affine2D()
+        self.transform = self.camera + axes.transData
+        self.map = None
+        self.map_window = None
+        self.cars = LineCollection([], linewidths=2, colors='black',
+                                   transform=self.transform, animated=True)
+        axes.add_collection(self.cars, autolim=False)
+        self.trajectories = LinePool(axes, self.transform,
+                                     linewidth=1, color='orange')
+        self.fps_text = axes.text(0.01, 0.98, '', transform=axes.transAxes,
+                                  va='top', animated=True)
+
+        self.background = None
+        self.frame_times = collections.deque(maxlen=fps_window)
+        self.fps = 0.
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def set_map(self, route_map, is_loop=True):
+        """
+        Draws the lane edges of a Map through the camera.
+        """
+        if not route_map.map:
+            route_map.add_to(self.axes)
+        for line in route_map.map:
+            line.set_transform(self.transform)
+            line.set_animated(True)
+        self.map = route_map
+        self.map_loop = is_loop
+
+    def set_camera(self, x, y, s=None):
+        """
+        Centers the view on x, y. With s, only the map around s is drawn.
+        """
+        self.camera.clear().translate(-x, -y)
+        if s is not None:
+            self.map_window = (s - 2 * self.view_x, s + 2 * self.view_x)
+
+    def set_cars(self, x, y, yaw, length=5, width=2, colors=None):
+        """
+        Car poses as arrays, colors is one color or one per car.
+        """
+        self.cars.set_segments(outlines(
+            np.asarray(x, dtype=float), np.asarray(y, dtype=float),
+            np.asarray(yaw, dtype=float), length, width))
+        if colors is not None:
+            self.cars.set_color(colors)
+
+    def set_trajectories(self, xs, ys):
+        self.trajectories.set_data(xs, ys)
+
+    def artists(self):
+        lines = self.map.map if self.map is not None else []
+        return lines + [self.cars] + self.trajectories.lines + \
+            [self.fps_text]
+
+    def render(self):
+        """
+        Draws one frame and returns the frame rate over the last frames.
+        """
+        if self.map is not None:
+            self.map.draw(self.map_loop, self.map_window)
+        now = time.time()
+        self.frame_times.append(now)
+        if len(self.frame_times) > 1:
+            self.fps = (len(self.frame_times) - 1) / \
+                max(now - self.frame_times[0], 1e-9)
+        self.fps_text.set_text('%.0f FPS' % self.fps)
+
+        if self.background is None:
+            # the draw event caches the background and draws the artists
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_artists()
+        self.canvas.blit(self.axes.bbox)
+        self.canvas.flush_events()
+        return self.fps
+
+    def _on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self.artists():
+            self.axes.draw_artist(artist)
+
+
+def main():
+    import matplotlib.pyplot as plt
+    from fleet import Fleet
+    from map import Map
+    from trajectory_generation import TrajectoryGenerator
+    print("Test Renderer class")
+    route_map = Map()
+    route_map.read("highway_map.csv")
+    route = route_map.route
+    rng = np.random.RandomState(0)
+    fleet = Fleet(route, 100)
+    fleet.v[:] = rng.uniform(15, 25, 100)
+    fleet.move_to_route(rng.uniform(0, 400, 100),
+                        rng.randint(0, route.lane_num, 100))
+
+    traj_gen = TrajectoryGenerator()
+    goal_d = route.to_d_many(rng.randint(0, route.lane_num, 50))
+    renderer = Renderer()
+    renderer.set_map(route_map)
+    plt.show(block=False)
+    for frame in range(300):
+        fleet.follow_route(0.05)
+        ego_s, ego_d, ego_v = fleet.s[0], fleet.d[0], fleet.v[0]
+        goal_s = np.column_stack([ego_s + ego_v * 3 + rng.uniform(-10, 10, 50),
+                                  np.full(50, ego_v), np.zeros(50)])
+        coefs_s, coefs_d = traj_gen.jmt_batch(
+            np.tile([ego_s, ego_v, 0.], (50, 1)), goal_s, 3.), \
+            traj_gen.jmt_batch(np.tile([ego_d, 0., 0.], (50, 1)),
+                               np.column_stack([goal_d, np.zeros((50, 2))]),
+                               3.)
+        _, s = traj_gen.evaluate(coefs_s, 3.)
+        _, d = traj_gen.evaluate(coefs_d, 3.)
+        x, y, _ = route.to_pose_many(s[0], d[0])
+
+        renderer.set_camera(fleet.x[0], fleet.y[0], ego_s)
+        renderer.set_cars(fleet.x, fleet.y, fleet.yaw)
+        renderer.set_trajectories(x, y)
+        fps = renderer.render()
+    print("100 cars, 50 trajectories: %.1f FPS" % fps)
+
+
+if __name__ == "__main__":
+    main()
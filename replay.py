@@ -0,0 +1,263 @@
+"""
+Binary replay log.
+
+A file is a fixed header followed by one fixed size record per tick, so
+it can be appended to while a run goes on and memory-mapped as a numpy
+structured array for random access to any tick:
+
+    header   magic, version, vehicles, max candidates, dt   (64 bytes)
+    records  tick, time, candidate count, lane (N,), state (N, 6),
+             T (C,), coefs (C, 2, 6)
+
+state holds s, d, x, y, yaw, v of every vehicle: the cars of a Simulator
+then the rows of its fleets. coefs are the s and d coefficients of the
+candidate trajectories of a TrajectoryGenerator, rows past the candidate
+count are NaN. A log cut short by a crash is read up to its last whole
+record.
+"""
+import os
+import struct
+import time
+import numpy as np
+
+MAGIC = b'REPLAYLG'
+VERSION = 1
+HEADER = struct.Struct('<8sIIId')
+HEADER_SIZE = 64
+STATE = ('s', 'd', 'x', 'y', 'yaw', 'v')
+
+
+def record_dtype(vehicles, candidates):
+    return np.dtype([('tick', '<i8'), ('time', '<f8'),
+                     ('candidates', '<i4'), ('lane', '<i4', (vehicles,)),
+                     ('state', '<f8', (vehicles, len(STATE))),
+                     ('T', '<f8', (candidates,)),
+                     ('coefs', '<f8', (candidates, 2, 6))])
+
+
+def vehicle_count(sim):
+    return len(sim.cars) + sum(len(fleet) for fleet in sim.fleets)
+
+
+class ReplayWriter:
+    """
+    Appends per-tick records through a preallocated buffer of
+    buffer_ticks records, written out in one call when full and on close.
+    Candidates beyond max_candidates are dropped.
+    """
+
+    def __init__(self, path, vehicles, max_candidates=8, dt=0.1,
+                 buffer_ticks=256):
+        self.path = path
+        self.dtype = record_dtype(vehicles, max_candidates)
+        self.buffer = np.zeros(buffer_ticks, dtype=self.dtype)
+        self.fields = dict((name, self.buffer[name])
+                           for name in self.dtype.names)
+        self.pending = 0
+        self.ticks = 0
+        self.file = open(path, 'wb')
+        header = HEADER.pack(MAGIC, VERSION, vehicles, max_candidates, dt)
+        self.file.write(header + b'\0' * (HEADER_SIZE - len(header)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _next(self, tick, sim_time):
+        """
+        Returns the buffer row of a new tick, its candidates cleared.
+        Fields are written through the per field views in self.fields,
+        which is much cheaper than through a record object.
+        """
+        if self.pending == len(self.buffer):
+            self.flush()
+        row = self.pending
+        self.pending += 1
+        self.ticks += 1
+        fields = self.fields
+        fields['tick'][row], fields['time'][row] = tick, sim_time
+        fields['candidates'][row] = 0
+        fields['T'][row] = np.nan
+        fields['coefs'][row] = np.nan
+        return row
+
+    def record(self, tick, sim_time, lane, state, coefs=(), T=()):
+        """
+        Logs lane (N,) and state (N, 6) with the (k, 2, 6) coefficients
+        and (k,) horizons of k candidates.
+        """
+        row = self._next(tick, sim_time)
+        self.fields['lane'][row], self.fields['state'][row] = lane, state
+        self._set_candidates(row, coefs, T)
+
+    def record_simulator(self, sim, traj_gen=None):
+        """
+        Logs the cars and fleets of a Simulator and the candidates of a
+        TrajectoryGenerator straight into the next record.
+        """
+        row = self._next(sim.tick, sim.time)
+        lane, state = self.fields['lane'][row], self.fields['state'][row]
+        for i, car in enumerate(sim.cars):
+            state[i] = [getattr(car, field, np.nan) for field in STATE]
+            lane[i] = getattr(car, 'lane', -1)
+        i = len(sim.cars)
+        for fleet in sim.fleets:
+            rows = slice(i, i + len(fleet))
+            for column, field in enumerate(STATE):
+                state[rows, column] = getattr(fleet, field)
+            lane[rows] = fleet.lane
+            i += len(fleet)
+        if traj_gen is not None:
+            self._set_candidates(row, traj_gen.traj_coefs, traj_gen.t)
+
+    def _set_candidates(self, row, coefs, T):
+        k = min(len(T), self.fields['T'].shape[1])
+        self.fields['candidates'][row] = k
+        if k:
+            self.fields['coefs'][row, :k] = np.asarray(coefs[:k],
+                                                       dtype=float)
+            self.fields['T'][row, :k] = T[:k]
+
+    def flush(self):
+        self.buffer[:self.pending].tofile(self.file)
+        self.pending = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class ReplayLog:
+    """
+    Memory-mapped replay log, log[i] is the record of the i-th logged
+    tick. Nothing is read until a record is accessed, so opening a log
+    takes the same time whatever its length.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("%s is not a replay log" % path)
+        magic, version, vehicles, candidates, self.dt = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a replay log" % path)
+        self.vehicles = vehicles
+        self.max_candidates = candidates
+        dtype = record_dtype(vehicles, candidates)
+        ticks = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+        self.records = np.memmap(path, dtype=dtype, mode='r',
+                                 offset=HEADER_SIZE, shape=(ticks,)) \
+            if ticks else np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+    def field(self, name):
+        """
+        One state column over all ticks, (ticks, N), e.g. field('v').
+        """
+        return self.records['state'][:, :, STATE.index(name)]
+
+    def candidates(self, i):
+        """
+        Returns (coefs, T) of the candidates logged at record i.
+        """
+        record = self.records[i]
+        k = record['candidates']
+        return record['coefs'][:k], record['T'][:k]
+
+    def restore(self, sim, i, traj_gen=None):
+        """
+        Puts the vehicles of sim, which must match the logged ones, and
+        the candidates of traj_gen back to record i without running any
+        callback or planner.
+        """
+        record = self.records[i]
+        state, lane = np.array(record['state']), np.array(record['lane'])
+        for j, car in enumerate(sim.cars):
+            if hasattr(car, 'route'):
+                car.s, car.d = float(state[j, 0]), float(state[j, 1])
+                car.lane = int(lane[j])
+                car.route_idx = car.route.get_idx(car.s)
+            car.x, car.y, car.yaw, car.v = state[j, 2:].tolist()
+        j = len(sim.cars)
+        for fleet in sim.fleets:
+            rows = slice(j, j + len(fleet))
+            for column, field in enumerate(STATE):
+                getattr(fleet, field)[:] = state[rows, column]
+            fleet.lane[:] = lane[rows]
+            fleet.route_idx[:] = fleet.route.get_idx(fleet.s)
+            j += len(fleet)
+        sim.tick, sim.time = int(record['tick']), float(record['time'])
+        if traj_gen is not None:
+            coefs, T = self.candidates(i)
+            traj_gen.clear()
+            traj_gen.traj_coefs.extend([c[0].copy(), c[1].copy()]
+                                       for c in coefs)
+            traj_gen.t.extend(T.tolist())
+
+
+def main():
+    import tempfile
+    from fleet import Fleet
+    from map import Route
+    from simulator import Simulator
+    from trajectory_generation import TrajectoryGenerator
+    print("Test ReplayWriter and ReplayLog classes")
+    route = Route()
+    route.read("highway_map.csv")
+    sim = Simulator(route)
+    ego = sim.add_car(s=0, lane=1, v=20)
+    fleet = sim.add_fleet(Fleet(route, 20))
+    rng = np.random.RandomState(0)
+    fleet.v[:] = rng.uniform(15, 25, 20)
+    fleet.move_to_route(rng.uniform(0, 300, 20), rng.randint(0, 3, 20))
+    traj_gen = TrajectoryGenerator()
+
+    def plan(sim):
+        traj_gen.clear()
+        start_s, start_d = [ego.s, ego.v, 0], [ego.d, 0, 0]
+        for lane in range(route.lane_num):
+            traj_gen.generate(start_s, start_d,
+                              [ego.s + ego.v * 3, ego.v, 0],
+                              [route.to_d(lane), 0, 0], 3)
+    sim.add_callback(plan)
+
+    # one hour at 10 Hz
+    path = os.path.join(tempfile.mkdtemp(), 'run.replay')
+    ticks = 36000
+    start = time.time()
+    with ReplayWriter(path, vehicle_count(sim)) as writer:
+        for _ in range(ticks):
+            sim.step()
+            writer.record_simulator(sim, traj_gen)
+    print("%d ticks simulated and logged in %.1f s, %.1f MB" %
+          (ticks, time.time() - start, os.path.getsize(path) / 1e6))
+
+    start = time.time()
+    log = ReplayLog(path)
+    speeds = log.field('v')
+    print("opened %d ticks in %.2f ms, mean speed %.1f m/s" %
+          (len(log), (time.time() - start) * 1e3, speeds.mean()))
+
+    expected = ego.x, fleet.x.copy(), [c[0] for c in traj_gen.traj_coefs]
+    log.restore(sim, 1000, traj_gen)
+    log.restore(sim, len(log) - 1, traj_gen)
+    print("restored last tick %d: ego x %s, fleet x %s, candidates %s" %
+          (sim.tick, ego.x == expected[0],
+           np.array_equal(fleet.x, expected[1]),
+           np.array_equal([c[0] for c in traj_gen.traj_coefs],
+                          expected[2])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Binary route format.
+
+A file is a fixed header, a directory of named blocks and the blocks
+themselves, each a C-contiguous (rows, cols) float64 array aligned to 64
+bytes, so every block can be opened as an np.memmap without copying:
+
+    header   magic, version, source mtime/size/sha1, is_loop, block count
+    blocks   name, rows, cols, byte offset   (one entry per block)
+    data     block arrays
+
+Route keeps all waypoint fields in one (len(Route.FIELDS), N) block named
+'route', derived tables are stored as further blocks.
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import numpy as np
+
+MAGIC = b'ROUTEBIN'
+VERSION = 1
+SUFFIX = '.route'
+ALIGN = 64
+
+HEADER = struct.Struct('<8sIdQ20sBxxxI')
+BLOCK = struct.Struct('<16sIQQ')
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.digest()
+
+
+def write(path, blocks, is_loop=True, source=None):
+    """
+    Writes a dict of name -> 2D float64 array. When source is given its
+    mtime, size and sha1 are recorded so the file can act as its cache.
+    The file is written to a temporary file of its own next to path and
+    renamed into place, so concurrent writers never share one.
+    """
+    mtime, size, sha1 = 0., 0, b''
+    if source is not None:
+        stat = os.stat(source)
+        mtime, size, sha1 = stat.st_mtime, stat.st_size, file_sha1(source)
+
+    entries = _layout(dict((name, np.shape(block))
+                           for name, block in blocks.items()))
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path),
+                               dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _write_header(f, entries, is_loop, mtime, size, sha1)
+            for name, rows, cols, offset in entries:
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(np.ascontiguousarray(blocks[name],
+                                             dtype='<f8').tobytes())
+        # mkstemp files are private, route files are shared like the source
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def create(path, shapes, is_loop=True):
+    """
+    Creates a route file of zeroed blocks from a dict of name -> (rows,
+    cols) and returns them mapped writable, so files larger than memory
+    can be filled piece by piece.
+    """
+    entries = _layout(shapes)
+    with open(path, 'wb') as f:
+        _write_header(f, entries, is_loop)
+        if entries:
+            name, rows, cols, offset = entries[-1]
+            f.truncate(offset + rows * cols * 8)
+    return open_blocks(path, dict((name, (rows, cols, offset))
+                                  for name, rows, cols, offset in entries),
+                       mode='r+')
+
+
+def _layout(shapes):
+    """
+    Returns (name, rows, cols, offset) per block, sorted by name.
+    """
+    names = sorted(shapes)
+    offset = HEADER.size + BLOCK.size * len(names)
+    entries = []
+    for name in names:
+        offset += -offset % ALIGN
+        rows, cols = shapes[name]
+        entries.append((name, rows, cols, offset))
+        offset += rows * cols * 8
+    return entries
+
+
+def _write_header(f, entries, is_loop, mtime=0., size=0, sha1=b''):
+    f.write(HEADER.pack(MAGIC, VERSION, mtime, size, sha1,
+                        bool(is_loop), len(entries)))
+    for name, rows, cols, offset in entries:
+        f.write(BLOCK.pack(name.encode(), rows, cols, offset))
+
+
+def read_header(path):
+    """
+    Returns (header dict, {name: (rows, cols, offset)}) or None when path is
+    not a route file of the current version.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            return None
+        magic, version, mtime, size, sha1, is_loop, count = \
+            HEADER.unpack(raw)
+        if magic != MAGIC or version != VERSION:
+            return None
+        entries = {}
+        for _ in range(count):
+            name, rows, cols, offset = BLOCK.unpack(f.read(BLOCK.size))
+            entries[name.rstrip(b'\0').decode()] = (rows, cols, offset)
+    header = {'mtime': mtime, 'size': size, 'sha1': sha1,
+              'is_loop': bool(is_loop)}
+    return header, entries
+
+
+def open_blocks(path, entries, mode='r'):
+    """
+    Maps every block, read-only by default, no data is copied.
+    """
+    return dict((name, np.memmap(path, dtype='<f8', mode=mode,
+                                 offset=offset, shape=(rows, cols)))
+                for name, (rows, cols, offset) in entries.items())
+
+
+def load(path):
+    """
+    Opens a route file, returns (is_loop, blocks) or None. Blocks are
+    mapped copy-on-write: they can be assigned to like any array, but
+    changes stay in memory and never reach the file.
+    """
+    parsed = read_header(path)
+    if parsed is None:
+        return None
+    header, entries = parsed
+    return header['is_loop'], open_blocks(path, entries, mode='c')
+
+
+def cache_path(source, key=''):
+    """
+    Cache file of a source file, one per key so routes of different
+    classes or resolutions do not overwrite each other's tables.
+    """
+    return '%s.%s%s' % (source, key, SUFFIX) if key else source + SUFFIX
+
+
+def load_cache(source, is_loop, key=''):
+    """
+    Returns the copy-on-write mapped blocks cached for a source file, or
+    None when there is no cache or it is stale. The content hash of the
+    source is compared on every load, as an edit can keep both mtime and
+    size, only a size mismatch skips the hash.
+    """
+    path = cache_path(source, key)
+    try:
+        parsed = read_header(path)
+        stat = os.stat(source)
+    except (IOError, OSError):
+        return None
+    if parsed is None:
+        return None
+    header, entries = parsed
+    if header['is_loop'] != bool(is_loop) or header['size'] != stat.st_size:
+        return None
+    if header['sha1'] != file_sha1(source):
+        return None
+    return open_blocks(path, entries, mode='c')
+
+
+def save_cache(source, is_loop, blocks, key=''):
+    """
+    Writes the cache for a source file, silently skipped when the
+    directory is not writable.
+    """
+    try:
+        write(cache_path(source, key), blocks, is_loop, source)
+    except (IOError, OSError):
+        pass
+
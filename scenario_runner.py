@@ -0,0 +1,178 @@
+import collections
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+from fleet import Fleet
+from map import Route
+from trajectory_generation import TrajectoryGenerator
+
+ScenarioSpec = collections.namedtuple(
+    'ScenarioSpec', 'route_file cars planner steps dt is_loop')
+ScenarioSpec.__new__.__defaults__ = ({}, 200, 0.1, True)
+ScenarioSpec.__doc__ = """
+One episode: cars is a list of (s, lane, v), the first one is the ego car
+driven by the planner, planner holds planner parameters (see
+run_episode).
+"""
+
+
+class SharedRoute:
+    """
+    Route data parsed once in the parent and published in a shared memory
+    block. Workers attach to it and wrap it in a Route without copying.
+    """
+
+    def __init__(self, route_file, is_loop=True, lane_width=3.5, lane_num=3):
+        route = Route(lane_width, lane_num)
+        route.read(route_file, is_loop)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=route.data.nbytes)
+        np.ndarray(route.data.shape, buffer=self.shm.buf)[:] = route.data
+        self.spec = (self.shm.name, route.data.shape,
+                     lane_width, lane_num, is_loop)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    @staticmethod
+    def attach(spec):
+        """
+        Returns (route, shm) for a spec, keep shm alive as long as route.
+        """
+        name, shape, lane_width, lane_num, is_loop = spec
+        shm = shared_memory.SharedMemory(name=name)
+        route = Route(lane_width, lane_num)
+        route.is_loop = is_loop
+        route.set_data(np.ndarray(shape, buffer=shm.buf))
+        return route, shm
+
+
+_worker_routes = {}
+
+
+def _init_worker(route_specs):
+    for key, spec in route_specs.items():
+        _worker_routes[key] = SharedRoute.attach(spec)
+
+
+def _run_in_worker(episode, index, spec):
+    route, _ = _worker_routes[(spec.route_file, spec.is_loop)]
+    return index, episode(spec, route)
+
+
+def run_episode(spec, route):
+    """
+    Default episode: the ego car re-plans one JMT candidate per lane each
+    tick and executes the first dt of the one ending in planner['lane']
+    (default: its starting lane), the other cars follow their lane.
+
+    Planner parameters: T (horizon, 3), lane, v (goal speed, start speed).
+    Returns per-episode metrics.
+    """
+    start = time.time()
+    T = spec.planner.get('T', 3.)
+    traj_gen = TrajectoryGenerator()
+    ego_s, ego_lane, ego_v = spec.cars[0]
+    lane = spec.planner.get('lane', ego_lane)
+    goal_v = spec.planner.get('v', ego_v)
+    state_s = np.array([ego_s, ego_v, 0.])
+    state_d = np.array([route.to_d(ego_lane), 0., 0.])
+
+    others = Fleet(route)
+    for s, car_lane, v in spec.cars[1:]:
+        others.add_car(s, car_lane, v)
+
+    goal_d = route.to_d_many(np.arange(route.lane_num))
+    n = len(goal_d)
+    min_gap = np.inf
+    max_jerk = 0.
+    for _ in range(spec.steps):
+        others.follow_route(spec.dt)
+        coefs_s = traj_gen.jmt_batch(
+            np.tile(state_s, (n, 1)),
+            np.tile([state_s[0] + goal_v * T, goal_v, 0.], (n, 1)), T)
+        coefs_d = traj_gen.jmt_batch(
+            np.tile(state_d, (n, 1)),
+            np.column_stack([goal_d, np.zeros((n, 2))]), T)
+
+        _, traj_s = traj_gen.evaluate(coefs_s[lane], T, spec.dt)
+        _, traj_d = traj_gen.evaluate(coefs_d[lane], T, spec.dt)
+        max_jerk = max(max_jerk, np.abs(traj_s[3]).max(),
+                       np.abs(traj_d[3]).max())
+        state_s = traj_s[:3, 0, 1]
+        state_d = traj_d[:3, 0, 1]
+
+        if len(others):
+            same_lane = np.abs(others.d - state_d[0]) < route.lane_width
+            # others wrap around loops, the ego s does not
+            gap = others.s[same_lane] - state_s[0]
+            if route.is_loop:
+                half = route.length / 2.
+                gap = route.wrap_s(gap + half) - half
+            gap = np.abs(gap)
+            if len(gap):
+                min_gap = min(min_gap, gap.min())
+
+    return {
+        'distance': float(state_s[0] - ego_s),
+        'final_d': float(state_d[0]),
+        'min_gap': float(min_gap),
+        'max_jerk': float(max_jerk),
+        'wall_time': time.time() - start,
+    }
+
+
+class ScenarioRunner:
+    """
+    Runs scenario specs across a process pool. Each distinct route file is
+    parsed once and shared with the workers through shared memory, and
+    results are yielded as (index, metrics) as soon as episodes finish.
+    """
+
+    def __init__(self, workers=None, episode=run_episode):
+        self.workers = workers
+        self.episode = episode
+
+    def run(self, specs):
+        specs = list(specs)
+        shared = {}
+        try:
+            for spec in specs:
+                key = (spec.route_file, spec.is_loop)
+                if key not in shared:
+                    shared[key] = SharedRoute(spec.route_file, spec.is_loop)
+            route_specs = dict((key, route.spec)
+                               for key, route in shared.items())
+            with ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                     initargs=(route_specs,)) as pool:
+                futures = [pool.submit(_run_in_worker, self.episode, i, spec)
+                           for i, spec in enumerate(specs)]
+                for future in as_completed(futures):
+                    yield future.result()
+        finally:
+            for route in shared.values():
+                route.close()
+
+
+def main():
+    print("Test ScenarioRunner class")
+    rng = np.random.RandomState(0)
+    specs = []
+    for i in range(64):
+        cars = [(0., 1, 20.)] + [(rng.uniform(10, 300), rng.randint(3),
+                                 rng.uniform(10, 25)) for _ in range(10)]
+        specs.append(ScenarioSpec('highway_map.csv', cars,
+                                  {'T': rng.uniform(2, 5),
+                                   'lane': rng.randint(3)}))
+    start = time.time()
+    done = 0
+    for index, metrics in ScenarioRunner().run(specs):
+        done += 1
+    print("%d episodes in %.2f s, last: %d %s" %
+          (done, time.time() - start, index, metrics))
+
+
+if __name__ == "__main__":
+    main()
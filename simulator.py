@@ -0,0 +1,147 @@
+import math
+import time
+from car import Car
+from map import Map
+
+
+class Simulator:
+    """
+    Headless simulation loop. Cars attached to a route advance with
+    Car.follow_route, free cars with Car.drive and fleets with one
+    vectorized Fleet.follow_route, as fast as the CPU allows.
+    matplotlib is only imported once render() is called.
+
+    Callbacks registered with add_callback run at the start of a tick,
+    before anything moves, each at its own rate, e.g. perception at 10 Hz
+    and planning at 5 Hz (see agents.Agents).
+    """
+
+    def __init__(self, route=None, dt=0.1):
+        self.route = route
+        self.dt = dt
+        self.cars = []
+        self.fleets = []
+        self.tick = 0
+        self.time = 0.
+        self.map = None
+        self.axes = None
+        self.callbacks = []
+
+    def add_car(self, car=None, s=None, lane=0, v=0):
+        """
+        Adds a car, placing it on the route at s when given.
+        Returns the car.
+        """
+        if car is None:
+            car = Car(id=len(self.cars), label=str(len(self.cars)))
+        if s is not None:
+            car.set_route(self.route, s, lane)
+        car.v = v
+        self.cars.append(car)
+        return car
+
+    def add_fleet(self, fleet):
+        self.fleets.append(fleet)
+        return fleet
+
+    def add_callback(self, callback, rate=None, phase=0):
+        """
+        Calls callback(sim) every tick, or at rate Hz: every
+        round(1 / (rate * dt)) ticks, counted from tick phase.
+        Callbacks run in the order they were added. Returns callback.
+        """
+        period = 1 if rate is None else \
+            max(int(round(1. / (rate * self.dt))), 1)
+        self.callbacks.append((callback, period, phase))
+        return callback
+
+    def remove_callback(self, callback):
+        self.callbacks = [entry for entry in self.callbacks
+                          if entry[0] is not callback]
+
+    def step(self):
+        for callback, period, phase in self.callbacks:
+            if (self.tick - phase) % period == 0:
+                callback(self)
+        for car in self.cars:
+            if hasattr(car, 'route'):
+                car.follow_route(self.dt)
+            else:
+                car.drive(self.dt)
+        for fleet in self.fleets:
+            fleet.follow_route(self.dt)
+        self.tick += 1
+        self.time += self.dt
+
+    def run(self, steps):
+        """
+        Runs a number of steps and returns the achieved steps per second.
+        """
+        start = time.time()
+        for _ in range(steps):
+            self.step()
+        return steps / max(time.time() - start, 1e-9)
+
+    def render(self, axes=None, view_x=80):
+        """
+        Draws the current state around the first car, creating a figure
+        when no axes are given. Returns the axes.
+        """
+        if self.axes is None:
+            if axes is None:
+                import matplotlib.pyplot as plt
+                axes = plt.figure(figsize=(12, 8)).add_subplot(
+                    111, aspect='equal')
+            self.axes = axes
+            if self.route is not None:
+                self.map = Map(lane_width=self.route.lane_width,
+                               lane_num=self.route.lane_num)
+                self.map.route = self.route
+                self.map.add_to(axes)
+            for car in self.cars:
+                car.add_to(axes)
+
+        if self.map is not None:
+            s_window = None
+            if self.cars and hasattr(self.cars[0], 'route'):
+                s = self.cars[0].s
+                s_window = (s - 2 * view_x, s + 2 * view_x)
+            self.map.draw(self.route.is_loop, s_window)
+        for car in self.cars:
+            car.draw()
+        if self.cars:
+            view_y = view_x / 2.
+            self.axes.set_xlim(self.cars[0].x - view_x,
+                               self.cars[0].x + view_x)
+            self.axes.set_ylim(self.cars[0].y - view_y,
+                               self.cars[0].y + view_y)
+        return self.axes
+
+
+def main():
+    from map import Route
+    print("Test Simulator class")
+    route = Route()
+    route.read("highway_map.csv")
+    sim = Simulator(route)
+    for i in range(route.lane_num):
+        sim.add_car(s=i * 20, lane=i, v=20 - i * 2)
+    free = sim.add_car(Car(label='free'), v=2)
+    free.set_pose(0, 0, math.pi / 4)
+    print("steps/s: %.0f" % sim.run(10000))
+
+    # one full lap plus a bit: s wraps and the car stays on its lane
+    lap = Simulator(route)
+    car = lap.add_car(s=route.length - 50, lane=1, v=25)
+    lap.run(int(route.length / (car.v * lap.dt)) + 50)
+    s, d = route.to_frenet(car.x, car.y)
+    print("after a lap: s %.1f of %.1f m, d %.2f m (lane center %.2f m)" %
+          (car.s, route.length, d, route.to_d(1)))
+
+    import matplotlib.pyplot as plt
+    sim.render()
+    plt.show()
+
+
+if __name__ == "__main__":
+    main()
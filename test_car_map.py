@@ -1,64 +1,54 @@
 from car import Car
 from map import Map
-import math
-from numpy import zeros
+from renderer import Renderer
+import time
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-from matplotlib.text import Annotation
 import matplotlib.ticker as ticker
-import matplotlib.animation as animation
 
 
-class DriveCar(animation.TimedAnimation):
-    def __init__(self):
+class DriveCar:
+    def __init__(self, interval=0.05):
         self.fig, self.axes = plt.subplots(1, 1, figsize=(12, 8))
-        self.axes.grid(True, color='grey', linestyle=':')
-        self.axes.set_aspect("equal")
         self.axes.xaxis.set_major_locator(ticker.MultipleLocator(10))
         self.axes.yaxis.set_major_locator(ticker.MultipleLocator(10))
+        self.interval = interval
 
-        self.map = Map(self.axes)
+        self.map = Map()
         self.map.read("highway_map.csv")
 
-        self.cars = [Car(self.axes, label='0'),
-                     Car(self.axes, label='1'),
-                     Car(self.axes, label='2')]
+        self.cars = [Car(), Car(), Car()]
         for i in range(len(self.cars)):
             self.cars[i].set_route(self.map.route, s=i * 20, lane=i)
             self.cars[i].v = 40 - i * 2
 
-        animation.TimedAnimation.__init__(
-            self, self.fig, interval=50, blit=False)
+        # the camera follows car 0, the map is drawn around its s
+        self.renderer = Renderer(self.axes, view_x=50)
+        self.renderer.set_map(self.map)
 
-    def _draw_frame(self, framedata, action_masks=[1, 0, 0, 0]):
+    def _draw_frame(self):
         # Update simulation
         for car in self.cars:
             car.follow_route()
 
         # Update visualization elements
-        self._drawn_artists = []
-        self._drawn_artists[:] = []
-        self._drawn_artists.extend(self.map.draw())
-        for car in self.cars:
-            self._drawn_artists.extend(car.draw())
-
-        # Update view
-        view_x = 50
-        view_y = view_x / 2
-        self.axes.set_xlim(self.cars[0].x - view_x, self.cars[0].x + view_x)
-        self.axes.set_ylim(self.cars[0].y - view_y, self.cars[0].y + view_y)
-        #ax.autoscale_view()
-
-    def new_frame_seq(self):
-        return iter(range(50))
-
-    def _init_draw(self):
-        pass
+        ego = self.cars[0]
+        self.renderer.set_camera(ego.x, ego.y, ego.s)
+        self.renderer.set_cars([car.x for car in self.cars],
+                               [car.y for car in self.cars],
+                               [car.yaw for car in self.cars])
+        return self.renderer.render()
+
+    def run(self, frames=600):
+        plt.show(block=False)
+        for _ in range(frames):
+            if not plt.fignum_exists(self.fig.number):
+                break
+            start = time.time()
+            fps = self._draw_frame()
+            time.sleep(max(self.interval - (time.time() - start), 0))
+        return fps
 
 
 av = DriveCar()
-# Writer = animation.writers['ffmpeg']
-# writer = Writer(fps=15, metadata=dict(artist='Me'), bitrate=1800)
-# av.save('PLAN-4223.mp4', writer=writer)
-plt.show()
+print("%.0f FPS" % av.run())
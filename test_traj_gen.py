@@ -1,49 +1,102 @@
 from car import Car
 from map import Map
+from renderer import Renderer
 from trajectory_generation import TrajectoryGenerator
-import math
-from numpy import zeros
+from jmt_cache import JMTCache
+from profiling import Profiler
+from planner import RecedingHorizonPlanner
+from trajectory_cost import TrajectoryCost
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-from matplotlib.text import Annotation
 import matplotlib.ticker as ticker
-import matplotlib.animation as animation
+import sys
 import time
 
-class DriveCar(animation.TimedAnimation):
-    def __init__(self):
+class DriveCar:
+    def __init__(self, receding_horizon=True, interval=0.05):
         self.fig, self.axes = plt.subplots(1, 1, figsize=(12, 8))
-        self.axes.grid(True, color='grey', linestyle=':')
-        self.axes.set_aspect("equal")
         self.axes.xaxis.set_major_locator(ticker.MultipleLocator(10))
         self.axes.yaxis.set_major_locator(ticker.MultipleLocator(10))
+        self.interval = interval
 
-        self.map = Map(self.axes)
+        self.map = Map()
         self.map.read("highway_map.csv")
 
-        self.cars = [Car(self.axes, label='0')]
+        self.cars = [Car(label='0')]
         for i in range(len(self.cars)):
             self.cars[i].set_route(self.map.route, s=i * 20, lane=i)
             self.cars[i].v = 20 - i * 2
 
-        self.traj_gen = TrajectoryGenerator([self.axes])
-        self.traj_gen.set_transform(self.cars[0].route.to_pose)
+        # the planner solves its candidates with jmt_batch, the JMTCache
+        # only speeds up the one at a time jmt of the per frame re-plan
+        self.traj_gen = TrajectoryGenerator(
+            cache=None if receding_horizon else JMTCache(quantum=1e-3))
+        # keeps the chosen trajectory and re-plans from a few steps ahead
+        # on it, instead of from the car every frame
+        self.planner = None
+        if receding_horizon:
+            self.planner = RecedingHorizonPlanner(
+                self.traj_gen,
+                TrajectoryCost(self.map.route, traj_gen=self.traj_gen))
+        self.frame = 0
 
-        animation.TimedAnimation.__init__(
-            self, self.fig, interval=50, blit=False)
+        # the camera follows car 0, the map is drawn around its s
+        self.renderer = Renderer(self.axes, view_x=80)
+        self.renderer.set_map(self.map)
 
-        self.test = 0
+        self.profiler = Profiler()
+        self.profiler.instrument_hot_paths()
         self.last_call = time.time()
 
-    def _draw_frame(self, framedata, action_masks=[1, 0, 0, 0]):
+    def _draw_frame(self):
+        # the interval also holds the pacing sleep between frames
+        self.profiler.histogram('frame_interval').record(
+            time.time() - self.last_call)
+        self.last_call = time.time()
+        with self.profiler.timer('frame'):
+            return self._update_frame()
+
+    def _update_frame(self):
+        if self.planner is not None:
+            self._plan_frame()
+        else:
+            self._replan_frame()
+
+        # Update visualization elements
+        ego = self.cars[0]
+        route = ego.route
+        xs, ys = [], []
+        for traj, T in zip(self.traj_gen.traj_coefs, self.traj_gen.t):
+            s, d = self.traj_gen.draw_traj(traj, T)
+            x, y, _ = route.to_pose_many(s, d)
+            xs.append(x)
+            ys.append(y)
+        self.renderer.set_camera(ego.x, ego.y, ego.s)
+        self.renderer.set_cars([car.x for car in self.cars],
+                               [car.y for car in self.cars],
+                               [car.yaw for car in self.cars])
+        self.renderer.set_trajectories(xs, ys)
+        return self.renderer.render()
+
+    def _plan_frame(self):
+        ego = self.cars[0]
+        for car in self.cars[1:]:
+            car.follow_route()
+        dt = self.planner.dt
+        t = self.frame * dt
+        # neighbouring lanes, 2 to 4 s horizons and speeds up to 22 m/s
+        self.planner.plan_lattice(
+            t, ego.s, ego.v, ego.d, horizons=(2., 3., 4.),
+            speeds=(16., 18., 20., 22.), max_lane_change=1,
+            speed_limits=(0., 22.), max_acc=2., max_candidates=24)
+        self.planner.follow(ego, t + dt)
+        self.frame += 1
+
+    def _replan_frame(self):
         # Update simulation
         for car in self.cars:
             car.follow_route()
 
-        # self.test+=1
-        # if self.test>=3: return
-
         # Update trajectory generation
         self.traj_gen.clear()
         start_s = [self.cars[0].s, self.cars[0].v, 0]
@@ -51,35 +104,23 @@ class DriveCar(animation.TimedAnimation):
         T = 3
         for i in range(self.cars[0].route.lane_num):
             goal_d = [self.cars[0].route.to_d(i), 0, 0]
-            delta_d = goal_d[0] - start_d[0]
             goal_s = [start_s[0] + self.cars[0].v * T, self.cars[0].v, 0]
-            #print start_s,start_d,goal_s,goal_d
             self.traj_gen.generate(start_s, start_d, goal_s, goal_d, T)
 
-        # Update visualization elements
-        self.map.draw()
-        for car in self.cars:
-            car.draw()
-        self.traj_gen.draw()
-
-        # Update view
-        view_x = 80
-        view_y = view_x / 2
-        self.axes.set_xlim(self.cars[0].x - view_x, self.cars[0].x + view_x)
-        self.axes.set_ylim(self.cars[0].y - view_y, self.cars[0].y + view_y)
-        #ax.autoscale_view()
-        print time.time() - self.last_call
-        self.last_call = time.time()
-
-    def new_frame_seq(self):
-        return iter(range(50))
-
-    def _init_draw(self):
-        pass
+    def run(self, frames=600):
+        plt.show(block=False)
+        for _ in range(frames):
+            if not plt.fignum_exists(self.fig.number):
+                break
+            start = time.time()
+            fps = self._draw_frame()
+            time.sleep(max(self.interval - (time.time() - start), 0))
+        return fps
 
 
 av = DriveCar()
-# Writer = animation.writers['ffmpeg']
-# writer = Writer(fps=15, metadata=dict(artist='Me'), bitrate=1800)
-# av.save('PLAN-4223.mp4', writer=writer)
-plt.show()
+print("%.0f FPS" % av.run())
+print(av.profiler.report())
+# python test_traj_gen.py profile.json also exports the timings
+if len(sys.argv) > 1:
+    av.profiler.to_json(sys.argv[1])
@@ -0,0 +1,250 @@
+import numpy as np
+from trajectory_generation import TrajectoryGenerator
+
+
+class TrajectoryCost:
+    """
+    Ranks a batch of candidate trajectories. Every cost term is an (N,)
+    array computed with array operations over all candidates, the total
+    is their weighted sum.
+
+    Terms:
+        jerk_max        peak |jerk| of s plus peak |jerk| of d
+        jerk_integral   integral of squared jerk, closed form per row
+        acc_limit       peak acceleration magnitude above max_acc
+        speed_limit     peak speed above max_speed or below zero
+        lane_deviation  mean |d| distance to the nearest lane center
+        proximity       peak (1 - gap / safe_distance)^2, gap being the
+                        s distance to the nearest vehicle in the same lane,
+                        quantized to proximity_resolution
+    """
+    WEIGHTS = {
+        'jerk_max': 1.,
+        'jerk_integral': .1,
+        'acc_limit': 100.,
+        'speed_limit': 100.,
+        'lane_deviation': 10.,
+        'proximity': 1000.,
+    }
+
+    def __init__(self, route, weights=None, max_speed=22., max_acc=10.,
+                 safe_distance=15., proximity_resolution=0.5, traj_gen=None):
+        self.route = route
+        self.weights = dict(self.WEIGHTS)
+        self.weights.update(weights or {})
+        self.max_speed = max_speed
+        self.max_acc = max_acc
+        self.safe_distance = safe_distance
+        self.proximity_resolution = proximity_resolution
+        self.traj_gen = traj_gen or TrajectoryGenerator()
+
+    def evaluate(self, coefs_s, coefs_d, T, obs_s=(), obs_d=(), obs_v=(),
+                 dt=0.1):
+        """
+        coefs_s, coefs_d are (N, 6), T is a scalar or (N,) array of
+        horizons. Returns the (N,) total cost and a dict of (N,) terms.
+        """
+        coefs_s = np.asarray(coefs_s, dtype=float).reshape(-1, 6)
+        coefs_d = np.asarray(coefs_d, dtype=float).reshape(-1, 6)
+        T = np.broadcast_to(np.asarray(T, dtype=float), coefs_s.shape[:1])
+        terms = dict((name, np.zeros(len(T))) for name in self.weights)
+        for horizon in np.unique(T):
+            rows = T == horizon
+            group = self._evaluate(coefs_s[rows], coefs_d[rows], horizon,
+                                   obs_s, obs_d, obs_v, dt)
+            for name, value in group.items():
+                terms[name][rows] = value
+
+        total = np.zeros(len(T))
+        for name, weight in self.weights.items():
+            if weight:
+                total += weight * terms[name]
+        return total, terms
+
+    def best(self, coefs_s, coefs_d, T, obs_s=(), obs_d=(), obs_v=(),
+             dt=0.1):
+        """
+        Returns the index of the cheapest candidate, the totals and terms.
+        """
+        total, terms = self.evaluate(coefs_s, coefs_d, T,
+                                     obs_s, obs_d, obs_v, dt)
+        return int(np.argmin(total)), total, terms
+
+    def _evaluate(self, coefs_s, coefs_d, T, obs_s, obs_d, obs_v, dt):
+        grid = self.traj_gen.time_grid(T, dt)
+        t, k, n = grid.t, len(grid), len(coefs_s)
+        # one product for position, velocity and acceleration of s and d,
+        # into a buffer reused across calls. Samples are (K, N) so every
+        # reduction over time is an elementwise pass over contiguous rows,
+        # and two (K, N) scratch planes keep the per sample terms in place.
+        samples = np.dot(grid.stacked[2].T, np.vstack([coefs_s, coefs_d]).T,
+                         out=grid.buffer((3 * k, 2 * n)))
+        pos_s, vel_s, acc_s = \
+            samples[:k, :n], samples[k:2 * k, :n], samples[2 * k:, :n]
+        pos_d, acc_d = samples[:k, n:], samples[2 * k:, n:]
+        scratch, lane = grid.buffer((2, k, n))
+        terms = {}
+
+        jerk_s, jerk_d = self._jerk_coefs(coefs_s), self._jerk_coefs(coefs_d)
+        terms['jerk_max'] = self._jerk_max(jerk_s, T) + \
+            self._jerk_max(jerk_d, T)
+        terms['jerk_integral'] = self._jerk_integral(jerk_s, T) + \
+            self._jerk_integral(jerk_d, T)
+
+        np.multiply(acc_s, acc_s, out=scratch)
+        np.multiply(acc_d, acc_d, out=lane)
+        scratch += lane
+        acc = np.sqrt(scratch.max(axis=0))
+        terms['acc_limit'] = np.maximum(acc - self.max_acc, 0)
+        terms['speed_limit'] = np.maximum(
+            np.maximum(vel_s.max(axis=0) - self.max_speed, 0),
+            -vel_s.min(axis=0))
+
+        # d in lane widths, less its lane index, is the offset from the
+        # lane center plus one half
+        np.multiply(pos_d, 1. / self.route.lane_width, out=scratch)
+        self._nearest_lane(scratch, out=lane, scaled=True)
+        scratch -= lane
+        scratch -= 0.5
+        np.abs(scratch, out=scratch)
+        terms['lane_deviation'] = \
+            scratch.mean(axis=0) * self.route.lane_width
+
+        terms['proximity'] = np.zeros(len(coefs_s))
+        if len(obs_s):
+            terms['proximity'] = self._proximity(
+                t, pos_s, lane, obs_s, obs_d, obs_v, out=scratch)
+        return terms
+
+    def _nearest_lane(self, d, out=None, scaled=False):
+        """
+        Lane index of d as floats, scaled when d is in lane widths.
+        """
+        lane = np.floor(d if scaled else d / self.route.lane_width, out=out)
+        return np.clip(lane, 0, self.route.lane_num - 1, out=lane)
+
+    def _proximity(self, t, ego_s, ego_lane, obs_s, obs_d, obs_v, out=None):
+        """
+        Peak closeness of each candidate to the nearest vehicle in the same
+        lane, from (K, N) samples of s and lane. Closeness is tabulated
+        once per (step, lane) on an s grid spanning the candidates, each
+        sample is then a single lookup of its flat table index. out, when
+        given, is a (K, N) scratch buffer.
+        """
+        k, n = ego_s.shape
+        lanes = self.route.lane_num
+        lo, hi = ego_s.min(), ego_s.max()
+        pred_s = np.asarray(obs_s, dtype=float) + np.outer(t, obs_v)
+        if self.route.is_loop:
+            # move every prediction to its copy nearest the candidates
+            length = self.route.length
+            pred_s += np.round(((lo + hi) / 2. - pred_s) / length) * length
+        obs_lane = self._nearest_lane(np.asarray(obs_d, dtype=float))
+
+        res = max(self.proximity_resolution, (hi - lo) / 4096.)
+        grid = lo + np.arange(int((hi - lo) / res) + 2) * res
+        gap = np.abs(grid[:, np.newaxis] - pred_s[:, np.newaxis, :])
+        table = np.full((k, lanes, len(grid)), np.inf)
+        for lane in range(lanes):
+            mask = obs_lane == lane
+            if np.any(mask):
+                table[:, lane] = gap[:, :, mask].min(axis=2)
+        table = np.maximum(1 - table / self.safe_distance, 0)**2
+
+        # nearest grid cell, rounded by truncating the index plus one half.
+        # Samples outside the grid are masked to no closeness rather than
+        # clamped onto its edge.
+        cell = np.multiply(ego_s, 1. / res, out=out)
+        cell += 0.5 - lo / res
+        valid = (cell >= 0) & (cell < len(grid))
+        index = cell.astype(np.intp)
+        index[~valid] = 0
+        # flat index of (step, lane, cell)
+        index += (ego_lane * len(grid)).astype(np.intp)
+        index += (np.arange(k) * (lanes * len(grid)))[:, np.newaxis]
+        closeness = table.ravel().take(index, out=out)
+        closeness[~valid] = 0
+        return closeness.max(axis=0)
+
+    def _jerk_max(self, jerk, T):
+        """
+        Peak |jerk| over [0, T] of (N, 3) jerk coefficients, jerk is
+        quadratic so the peak is at an end or at its vertex.
+        """
+        c0, c1, c2 = jerk.T
+        peak = np.maximum(np.abs(c0), np.abs(c0 + c1 * T + c2 * T**2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vertex = -c1 / (2 * c2)
+            inside = (vertex > 0) & (vertex < T)
+        vertex = vertex[inside]
+        peak[inside] = np.maximum(peak[inside], np.abs(
+            c0[inside] + c1[inside] * vertex + c2[inside] * vertex**2))
+        return peak
+
+    def _jerk_coefs(self, coefs):
+        """
+        (N, 3) coefficients of the third derivative of quintic rows.
+        """
+        return coefs[:, 3:] * np.array([6., 24., 60.])
+
+    def _jerk_integral(self, jerk, T):
+        """
+        Integral of jerk^2 over [0, T], jerk = c0 + c1 t + c2 t^2.
+        """
+        c0, c1, c2 = jerk.T
+        return c0**2 * T + c0 * c1 * T**2 + \
+            (c1**2 + 2 * c0 * c2) * T**3 / 3. + \
+            c1 * c2 * T**4 / 2. + c2**2 * T**5 / 5.
+
+
+def main():
+    import time
+    from map import Route
+    print("Test TrajectoryCost class")
+    route = Route()
+    route.read("highway_map.csv")
+    cost = TrajectoryCost(route)
+    traj_gen = cost.traj_gen
+    rng = np.random.RandomState(0)
+
+    n = 10000
+    start_s = np.tile([100., 20., 0.], (n, 1))
+    start_d = np.tile([route.to_d(1), 0., 0.], (n, 1))
+    goal_v = rng.uniform(10, 25, n)
+    goal_s = np.column_stack([100 + goal_v * 3, goal_v, np.zeros(n)])
+    goal_d = np.column_stack([route.to_d_many(rng.randint(0, 3, n)),
+                              np.zeros((n, 2))])
+    coefs_s = traj_gen.jmt_batch(start_s, goal_s, 3.)
+    coefs_d = traj_gen.jmt_batch(start_d, goal_d, 3.)
+    obs_s = rng.uniform(80, 200, 10)
+    obs_d = route.to_d_many(rng.randint(0, 3, 10))
+    obs_v = rng.uniform(10, 20, 10)
+
+    cost.best(coefs_s, coefs_d, 3., obs_s, obs_d, obs_v)
+    start = time.time()
+    for _ in range(10):
+        best, total, terms = cost.best(coefs_s, coefs_d, 3.,
+                                       obs_s, obs_d, obs_v)
+    print("%d candidates: %.1f ms, best %d cost %.3f" %
+          (n, (time.time() - start) * 100, best, total[best]))
+
+    # obstacles beyond the candidates' s range over the whole horizon add
+    # no proximity, ones within it match a direct computation up to the
+    # quantization of the table
+    far_s = np.array([-100., 0., 500., 2000.])
+    far = cost.evaluate(coefs_s, coefs_d, 3., far_s, np.full(4, 1.75),
+                        np.full(4, 10.))[1]['proximity']
+    t, samples = traj_gen.evaluate(coefs_s, 3.)
+    lane = cost._nearest_lane(traj_gen.evaluate(coefs_d, 3.)[1][0])
+    gap = np.abs(samples[0][:, :, np.newaxis] -
+                 (obs_s + np.outer(t, obs_v))[np.newaxis])
+    gap[lane[:, :, np.newaxis] != cost._nearest_lane(obs_d)] = np.inf
+    direct = (np.maximum(1 - gap.min(axis=2) / cost.safe_distance,
+                         0)**2).max(axis=1)
+    print("proximity: max %.2e beyond the horizon, max difference %.3f to "
+          "the direct computation" %
+          (far.max(), np.abs(terms['proximity'] - direct).max()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,78 @@
+from __future__ import print_function
+import collections
 import math
 import numpy as np
-from matplotlib.lines import Line2D
+
+
+class TimeGrid:
+    """
+    Fixed sample times 0, dt, 2 dt, ... built from an integer step count
+    and ending exactly at T: a horizon that is not a multiple of dt ends
+    with one shorter step instead of running past T. The power matrix
+    [1, t, ..., t^order] and the matrices of its derivatives are
+    precomputed. Evaluating (N, order + 1) coefficient rows
+    is then one matrix product, written into out when it is given, e.g.
+    a buffer from buffer() that is reused across calls.
+    """
+
+    def __init__(self, T, dt=0.1, order=5, derivatives=3):
+        self.T = T
+        self.dt = dt
+        steps = int(math.floor(T / dt + 1e-6))
+        t = np.arange(steps + 1) * dt
+        if T - t[-1] > 1e-6 * dt:
+            t = np.append(t, T)
+        t[-1] = T
+        self.t = t
+        # V[k] is the (K, order + 1) matrix of the k-th derivative
+        self.V = np.zeros((derivatives + 1, len(self.t), order + 1))
+        for k in range(derivatives + 1):
+            for i in range(k, order + 1):
+                scale = math.factorial(i) // math.factorial(i - k)
+                self.V[k, :, i] = scale * self.t ** (i - k)
+        # contiguous right hand sides: VT[k] is (order + 1, K) and
+        # stacked[k] is (order + 1, (k + 1) * K), derivatives 0..k side by
+        # side
+        self.VT = np.ascontiguousarray(self.V.transpose(0, 2, 1))
+        self.stacked = [np.ascontiguousarray(
+            self.V[:k + 1].reshape(-1, order + 1).T)
+            for k in range(derivatives + 1)]
+        self._buffers = {}
+
+    def __len__(self):
+        return len(self.t)
+
+    def buffer(self, shape):
+        """
+        A float64 output buffer owned by the grid, allocated once per
+        shape. Its contents are overwritten by the next user.
+        """
+        out = self._buffers.get(shape)
+        if out is None:
+            if len(self._buffers) >= 8:
+                self._buffers.clear()
+            out = self._buffers[shape] = np.empty(shape)
+        return out
+
+    def evaluate(self, coefs, derivative=0, out=None):
+        """
+        The derivative of (N, order + 1) rows at every sample as (N, K),
+        or (K,) for a single row.
+        """
+        return np.dot(coefs, self.VT[derivative], out=out)
+
+    def evaluate_all(self, coefs, derivatives=3, out=None):
+        """
+        Derivatives 0..derivatives as (derivatives + 1, N, K).
+        """
+        return np.matmul(coefs, self.VT[:derivatives + 1], out=out)
+
+    def evaluate_stacked(self, coefs, derivatives=2, out=None):
+        """
+        Derivatives 0..derivatives side by side as one (N, (derivatives +
+        1) * K) product.
+        """
+        return np.dot(coefs, self.stacked[derivatives], out=out)
 
 
 class TrajectoryGenerator:
@@ -10,25 +82,45 @@ class TrajectoryGenerator:
     JERK = 3
     TRAJ_S = 0
     TRAJ_D = 1
+    ORDER = 5
+    MAX_GRIDS = 64
+    # one candidate of lattice(): target lane, horizon and goal states
+    LATTICE = np.dtype([('lane', np.int64), ('T', float),
+                        ('goal_s', float, (3,)), ('goal_d', float, (3,))])
 
-    def __init__(self, axes):
+    def __init__(self, axes=None, cache=None):
         self.traj_coefs = []
+        self.cache = cache  # optional JMTCache used by jmt
         self.t = []
         self.lines = [[], [], [], []]
         self.axes = axes  # assuming [traj,vel,acc,jerk]
         self._draw_traj = self.draw_traj
-        self.lines[self.TRAJ].append(Line2D([], [], 1, color='orange'))
-        self.lines[self.TRAJ].append(Line2D([], [], 1, color='orange'))
-        self.lines[self.TRAJ].append(Line2D([], [], 1, color='orange'))
-        self.lines[self.VEL].append(Line2D([], [], 1, color='r'))
-        self.lines[self.VEL].append(Line2D([], [], 1, color='b'))
-        self.lines[self.ACC].append(Line2D([], [], 1, color='r'))
-        self.lines[self.ACC].append(Line2D([], [], 1, color='b'))
-        self.lines[self.JERK].append(Line2D([], [], 1, color='r'))
-        self.lines[self.JERK].append(Line2D([], [], 1, color='b'))
-
-        for line in self.lines[self.TRAJ]:
-            self.axes[self.TRAJ].add_line(line)
+        self._grids = collections.OrderedDict()
+        if axes is not None:
+            self.add_lines()
+
+    def add_lines(self):
+        """
+        Creates the line artists, matplotlib is only imported here. More
+        lines are added by draw as candidates need them.
+        """
+        self.lines = [[], [], [], []]
+        for i in range(3):
+            self.get_line(self.TRAJ, i)
+
+    def get_line(self, kind, i):
+        """
+        Returns line i of a kind, creating lines up to it on first use.
+        Trajectories are orange, s and d derivatives red and blue.
+        """
+        from matplotlib.lines import Line2D
+        lines = self.lines[kind]
+        while len(lines) <= i:
+            color = 'orange' if kind == self.TRAJ else \
+                ('r', 'b')[len(lines) % 2]
+            lines.append(Line2D([], [], linewidth=1, color=color))
+            self.axes[kind].add_line(lines[-1])
+        return lines[i]
 
     def clear(self):
         self.traj_coefs[:] = []
@@ -39,90 +131,185 @@ class TrajectoryGenerator:
             [self.jmt(start_s, goal_s, t), self.jmt(start_d, goal_d, t)])
         self.t.append(t)
 
+    def generate_batch(self, start_s, start_d, goal_s, goal_d, t):
+        """
+        Generates N candidates at once. States are (N, 3) arrays, t is a
+        scalar or an (N,) array. Returns (N, 6) coefficients for s and d.
+        """
+        coefs_s = self.jmt_batch(start_s, goal_s, t)
+        coefs_d = self.jmt_batch(start_d, goal_d, t)
+        t = np.broadcast_to(t, coefs_s.shape[:1])
+        self.traj_coefs.extend(zip(coefs_s, coefs_d))
+        self.t.extend(t.tolist())
+        return coefs_s, coefs_d
+
+    def lattice(self, route, start_s, start_d, horizons=(3.,), speeds=None,
+                accelerations=(0.,), max_lane_change=None,
+                speed_limits=(0., np.inf), max_acc=None,
+                max_candidates=None):
+        """
+        Goal states of the cross product of the route's lanes, horizons,
+        target speeds (default: the start speed) and end accelerations,
+        as a structured array of LATTICE rows. A goal s lies where a
+        constant acceleration from the start to the target speed ends.
+
+        Pruned are lane changes of more than max_lane_change lanes,
+        target speeds outside speed_limits and mean accelerations
+        |v - v_0| / T above max_acc. Beyond max_candidates, rows evenly
+        spread over the lattice are kept. When everything is pruned, the
+        one row kept stays in the current lane at the start speed clipped
+        to speed_limits, over the longest horizon.
+        """
+        current = np.clip(int(start_d[0] // route.lane_width), 0,
+                          route.lane_num - 1)
+        lanes = np.arange(route.lane_num)
+        if max_lane_change is not None:
+            lanes = lanes[np.abs(lanes - current) <= max_lane_change]
+        speeds = np.atleast_1d(start_s[1] if speeds is None else speeds)
+        speeds = speeds[(speeds >= speed_limits[0]) &
+                        (speeds <= speed_limits[1])]
+        lane, T, v, acc = [grid.ravel() for grid in np.meshgrid(
+            lanes, np.asarray(horizons, dtype=float),
+            np.asarray(speeds, dtype=float),
+            np.asarray(accelerations, dtype=float), indexing='ij')]
+        if max_acc is not None:
+            keep = np.abs(v - start_s[1]) <= max_acc * T
+            lane, T, v, acc = lane[keep], T[keep], v[keep], acc[keep]
+        if not len(T):
+            lane, T = np.array([current]), np.array([np.max(horizons)])
+            v = np.clip([start_s[1]], *speed_limits)
+            acc = np.zeros(1)
+        if max_candidates is not None and len(T) > max_candidates:
+            keep = np.linspace(0, len(T) - 1, max_candidates).round()
+            keep = keep.astype(np.int64)
+            lane, T, v, acc = lane[keep], T[keep], v[keep], acc[keep]
+
+        candidates = np.zeros(len(T), dtype=self.LATTICE)
+        candidates['lane'], candidates['T'] = lane, T
+        candidates['goal_s'][:, 0] = start_s[0] + (start_s[1] + v) / 2. * T
+        candidates['goal_s'][:, 1] = v
+        candidates['goal_s'][:, 2] = acc
+        candidates['goal_d'][:, 0] = route.to_d_many(lane)
+        return candidates
+
+    def generate_lattice(self, route, start_s, start_d, **options):
+        """
+        Generates every candidate of lattice(route, start_s, start_d,
+        **options) in one batched solve. Returns the candidates and their
+        (N, 6) coefficients for s and d.
+        """
+        candidates = self.lattice(route, start_s, start_d, **options)
+        n = len(candidates)
+        coefs_s, coefs_d = self.generate_batch(
+            np.tile(np.asarray(start_s, dtype=float), (n, 1)),
+            np.tile(np.asarray(start_d, dtype=float), (n, 1)),
+            candidates['goal_s'], candidates['goal_d'], candidates['T'])
+        return candidates, coefs_s, coefs_d
+
     def draw(self):
-        for i in range(len(self.t)):
-            x, y = self._draw_traj(self.traj_coefs[i], self.t[i])
-            self.lines[self.TRAJ][i].set_data(x, y)
-
-        return
-
-        i = -1
-        for traj, t in zip(self.traj_coefs, self.t):
-            i += 1
-            if i >= len(self.lines[self.TRAJ]):
-                self.lines[self.TRAJ].append(Line2D([], [], 1, color='orange'))
-                self.axes[self.TRAJ].add_line(self.lines[self.TRAJ][-1])
-            x, y = self._draw_traj(traj, t)
-            self.lines[self.TRAJ][i].set_data(x, y)
-
-            if len(self.axes) == 1:
-                continue
-            vel_s = self.differentiate(traj[self.TRAJ_S])
-            x, y = self.draw_curve(vel_s, t)
-            self.lines[self.VEL][i * 2].set_data(x, y)
-            vel_d = self.differentiate(traj[self.TRAJ_D])
-            x, y = self.draw_curve(vel_d, t)
-            self.lines[self.VEL][i * 2 + 1].set_data(x, y)
-
-            if len(self.axes) == 2:
-                continue
-            acc_s = self.differentiate(vel_s)
-            x, y = self.draw_curve(acc_s, t)
-            self.lines[self.ACC][i * 2].set_data(x, y)
-            acc_d = self.differentiate(vel_d)
-            x, y = self.draw_curve(vel_d, t)
-            self.lines[self.ACC][i * 2 + 1].set_data(x, y)
-
-            if len(self.axes) == 3:
-                continue
-            jerk_s = self.differentiate(acc_s)
-            x, y = self.draw_curve(jerk_s, t)
-            self.lines[self.JERK][i * 2].set_data(x, y)
-            jerk_d = self.differentiate(acc_d)
-            x, y = self.draw_curve(jerk_d, t)
-            self.lines[self.JERK][i * 2 + 1].set_data(x, y)
-
-        for i in range(4):
-            if len(self.axes) > i:
-                for line in self.lines[i]:
-                    self.axes[i].add_line(line)
+        """
+        Draws every candidate, one trajectory line each, plus its s and d
+        velocity, acceleration and jerk when those axes were given. Lines
+        of candidates dropped since the last draw are hidden.
+        """
+        kinds = len(self.axes)
+        for i, (traj, t) in enumerate(zip(self.traj_coefs, self.t)):
+            line = self.get_line(self.TRAJ, i)
+            line.set_data(*self._draw_traj(traj, t))
+            line.set_visible(True)
+            grid = self.time_grid(t)
+            for kind in range(self.VEL, kinds):
+                for axis in (self.TRAJ_S, self.TRAJ_D):
+                    line = self.get_line(kind, i * 2 + axis)
+                    line.set_data(grid.t, grid.evaluate(traj[axis], kind))
+                    line.set_visible(True)
+
+        for kind in range(kinds):
+            used = len(self.t) * (1 if kind == self.TRAJ else 2)
+            for line in self.lines[kind][used:]:
+                line.set_visible(False)
+        return [line for lines in self.lines[:kinds] for line in lines]
 
     def set_transform(self, to_pose):
+        """
+        Maps drawn (s, d) samples through to_pose, which must accept
+        arrays, e.g. Route.to_pose_many.
+        """
         def _draw_traj(traj, T):
             x, y = self.draw_traj(traj, T)
-            for i in range(len(x)):
-                x[i], y[i], _ = to_pose(x[i], y[i])
+            x, y, _ = to_pose(x, y)
             return x, y
 
         self._draw_traj = _draw_traj
 
     def draw_traj(self, traj, T):
-        t = 0
-        s = self.to_equation(traj[0])
-        d = self.to_equation(traj[1])
-        x = []
-        y = []
-        while t <= T + 0.01:
-            x.append(s(t))
-            y.append(d(t))
-            t += 0.1
-        return x, y
+        grid = self.time_grid(T)
+        return grid.evaluate(traj[0]), grid.evaluate(traj[1])
 
     def draw_curve(self, coef, T):
-        t = 0
-        func = self.to_equation(coef)
-        x = []
-        y = []
-        while t <= T + 0.01:
-            x.append(t)
-            y.append(func(t))
-            t += 0.1
-        return x, y
+        t = self.sample_times(T)
+        return t, self.polyval(coef, t)
+
+    def sample_times(self, T, dt=0.1):
+        """
+        Returns the sample times 0, dt, ..., T of the shared grid.
+        """
+        return self.time_grid(T, dt).t
+
+    def time_grid(self, T, dt=0.1):
+        """
+        Returns the TimeGrid of T and dt, built once and shared by every
+        candidate and tick. The MAX_GRIDS most recently used grids are
+        kept.
+        """
+        key = (float(T), float(dt))
+        grid = self._grids.pop(key, None)
+        if grid is None:
+            grid = TimeGrid(T, dt, self.ORDER)
+            if len(self._grids) >= self.MAX_GRIDS:
+                self._grids.popitem(last=False)
+        self._grids[key] = grid
+        return grid
+
+    def power_matrices(self, T, dt=0.1):
+        """
+        Returns (t, V) of the shared grid of T and dt, where V[k] is the
+        (K, 6) Vandermonde matrix of the k-th derivative, k = 0..3.
+        """
+        grid = self.time_grid(T, dt)
+        return grid.t, grid.V
+
+    def evaluate(self, coefs, T, dt=0.1, out=None):
+        """
+        Samples position, velocity, acceleration and jerk of (N, 6)
+        coefficient rows on the shared grid of T and dt.
+        Returns t and a (4, N, K) array, written into out when given.
+        """
+        grid = self.time_grid(T, dt)
+        coefs = np.asarray(coefs, dtype=float).reshape(-1, self.ORDER + 1)
+        return grid.t, grid.evaluate_all(coefs, out=out)
+
+    def polyval(self, coefs, t):
+        """
+        Evaluates polynomial coefficients, lowest order first, at times t
+        using Horner's scheme. (N, M) coefficients give an (N, K) result
+        for (K,) times, a single row gives a (K,) result.
+        """
+        coefs = np.asarray(coefs, dtype=float)
+        t = np.asarray(t, dtype=float)
+        if coefs.ndim == 2:
+            coefs = coefs.T[..., np.newaxis]
+        result = coefs[-1] * np.ones_like(t)
+        for c in coefs[-2::-1]:
+            result = result * t + c
+        return result
 
     def jmt(self, start, end, T):
         """
         Calculates Jerk Minimizing Trajectory for start, end and T.
         """
+        if self.cache is not None:
+            return self.cache.jmt(start, end, T)
         a_0, a_1, a_2 = start[0], start[1], start[2]
 
         A = np.array([
@@ -138,7 +325,30 @@ class TrajectoryGenerator:
         ])
 
         a_3_4_5 = np.linalg.solve(A, B)
-        alphas = np.concatenate([np.array([a_0, a_1, a_2]), a_3_4_5])
+        alphas = np.concatenate([np.array([a_0, a_1, .5 * a_2]), a_3_4_5])
+        return alphas
+
+    def jmt_batch(self, start, end, T):
+        """
+        Vectorized jmt for (N, 3) start/end states and scalar or (N,) T.
+        Uses the closed-form inverse of A, returns (N, 6) coefficients.
+        """
+        start = np.asarray(start, dtype=float).reshape(-1, 3)
+        end = np.asarray(end, dtype=float).reshape(-1, 3)
+        T = np.asarray(T, dtype=float)
+        a_0, a_1, a_2 = start[:, 0], start[:, 1], start[:, 2]
+
+        b_0 = end[:, 0] - (a_0 + a_1 * T + .5 * a_2 * T**2)
+        b_1 = (end[:, 1] - (a_1 + a_2 * T)) * T
+        b_2 = (end[:, 2] - a_2) * T**2
+
+        alphas = np.empty((len(start), 6))
+        alphas[:, 0] = a_0
+        alphas[:, 1] = a_1
+        alphas[:, 2] = .5 * a_2
+        alphas[:, 3] = (10 * b_0 - 4 * b_1 + .5 * b_2) / T**3
+        alphas[:, 4] = (-15 * b_0 + 7 * b_1 - b_2) / T**4
+        alphas[:, 5] = (6 * b_0 - 3 * b_1 + .5 * b_2) / T**5
         return alphas
 
     def to_equation(self, coefficients):
@@ -147,10 +357,7 @@ class TrajectoryGenerator:
         time from them.
         """
         def f(t):
-            total = 0.0
-            for i, c in enumerate(coefficients):
-                total += c * t ** i
-            return total
+            return self.polyval(coefficients, t)
         return f
 
     def differentiate(self, coefficients):
@@ -163,9 +370,15 @@ class TrajectoryGenerator:
             new_cos.append((deg + 1) * prev_co)
         return new_cos
 
+    def differentiate_batch(self, coefs):
+        """
+        Vectorized differentiate for (N, M) coefficient rows.
+        """
+        coefs = np.asarray(coefs, dtype=float)
+        return coefs[..., 1:] * np.arange(1, coefs.shape[-1])
+
 
 def test(traj_gen):
-    import collections
     TestCase = collections.namedtuple('JMT', 'start goal t answer')
     test_cases = [
         TestCase(start=[0, 10, 0], goal=[10, 10, 0], t=1,
@@ -181,12 +394,12 @@ def test(traj_gen):
         result_v = traj_gen.differentiate(result)
         result_a = traj_gen.differentiate(result_v)
         result_j = traj_gen.differentiate(result_a)
-        print "answer :", tc.answer
-        print "result s:", result
-        print "result v:", result_v
-        print "result a:", result_a
-        print "result j:", result_j
-        print ""
+        print("answer :", tc.answer)
+        print("result s:", result)
+        print("result v:", result_v)
+        print("result a:", result_a)
+        print("result j:", result_j)
+        print("")
 
 
 def main():
@@ -0,0 +1,215 @@
+import math
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+class StateLog:
+    """
+    Poses of a fixed set of cars at every tick, kept in preallocated
+    arrays that double when full, so recording a tick is a few array
+    writes. poses is (ticks, 3, N) of x, y, yaw, camera is (ticks, 3) of
+    x, y, s of the view center.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.ticks = 0
+        self._poses = None
+        self._camera = np.zeros((capacity, 3))
+
+    def __len__(self):
+        return self.ticks
+
+    @property
+    def poses(self):
+        if self._poses is None:
+            return np.zeros((0, 3, 0))
+        return self._poses[:self.ticks]
+
+    @property
+    def camera(self):
+        return self._camera[:self.ticks]
+
+    def record(self, x, y, yaw, camera):
+        """
+        Logs one tick, x, y, yaw are (N,) arrays, camera is (x, y, s).
+        """
+        pose = self._next(len(x))
+        pose[0], pose[1], pose[2] = x, y, yaw
+        self._camera[self.ticks - 1] = camera
+
+    def record_simulator(self, sim):
+        """
+        Logs the cars then the fleets of a Simulator straight into the
+        next row, the camera follows its first car.
+        """
+        fleets = sim.fleets
+        pose = self._next(len(sim.cars) + sum(len(f) for f in fleets))
+        for i, car in enumerate(sim.cars):
+            pose[:, i] = car.x, car.y, car.yaw
+        i = len(sim.cars)
+        for fleet in fleets:
+            pose[0, i:i + len(fleet)] = fleet.x
+            pose[1, i:i + len(fleet)] = fleet.y
+            pose[2, i:i + len(fleet)] = fleet.yaw
+            i += len(fleet)
+        s = getattr(sim.cars[0], 's', np.nan) if sim.cars else fleets[0].s[0]
+        self._camera[self.ticks - 1] = pose[0, 0], pose[1, 0], s
+
+    def _next(self, n):
+        """
+        Returns the (3, n) pose row of a new tick, growing the buffers.
+        """
+        if self._poses is None:
+            self._poses = np.zeros((self.capacity, 3, n))
+        if self.ticks == len(self._camera):
+            self._poses = np.concatenate([self._poses,
+                                          np.zeros_like(self._poses)])
+            self._camera = np.concatenate([self._camera,
+                                           np.zeros_like(self._camera)])
+        self.ticks += 1
+        return self._poses[self.ticks - 1]
+
+    def save(self, folder):
+        np.save(os.path.join(folder, 'poses.npy'), self.poses)
+        np.save(os.path.join(folder, 'camera.npy'), self.camera)
+
+    @staticmethod
+    def load(folder):
+        """
+        Returns memory-mapped (poses, camera) saved in folder.
+        """
+        return np.load(os.path.join(folder, 'poses.npy'), mmap_mode='r'), \
+            np.load(os.path.join(folder, 'camera.npy'), mmap_mode='r')
+
+
+_worker = {}
+
+
+def _init_worker(route_file, is_loop, view_x, figsize, dpi):
+    """
+    Builds one Agg figure and Renderer per worker, pyplot is never
+    imported so no GUI backend is touched.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from map import Map
+    from renderer import Renderer
+    figure = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(figure)
+    route_map = Map()
+    route_map.read(route_file, is_loop)
+    renderer = Renderer(figure.add_subplot(111), view_x)
+    renderer.set_map(route_map, is_loop)
+    renderer.fps_text.set_visible(False)
+    _worker['renderer'] = renderer
+
+
+def _render_frames(folder, frames):
+    import matplotlib.image
+    renderer = _worker['renderer']
+    poses, camera = StateLog.load(folder)
+    colors = ['r'] + ['black'] * (poses.shape[2] - 1)
+    for i in frames:
+        x, y, s = camera[i]
+        renderer.set_camera(x, y, None if np.isnan(s) else s)
+        renderer.set_cars(poses[i, 0], poses[i, 1], poses[i, 2],
+                          colors=colors)
+        renderer.render()
+        matplotlib.image.imsave(
+            os.path.join(folder, FrameExporter.FRAME % i),
+            np.asarray(renderer.canvas.buffer_rgba()))
+    return len(frames)
+
+
+class FrameExporter:
+    """
+    Renders a StateLog to PNG frames with the Agg backend across a
+    process pool, then encodes them to a video when ffmpeg is on PATH.
+    The log is saved once to the output folder and memory-mapped by the
+    workers, each of which renders contiguous runs of frames with its own
+    blitted Renderer.
+    """
+    FRAME = 'frame_%06d.png'
+
+    def __init__(self, route_file, is_loop=True, workers=None, view_x=80,
+                 figsize=(12, 8), dpi=100):
+        self.route_file = route_file
+        self.is_loop = is_loop
+        self.workers = workers or os.cpu_count()
+        self.view_x = view_x
+        self.figsize = figsize
+        self.dpi = dpi
+
+    def export(self, log, folder, fps=10, video=None):
+        """
+        Writes the frames to folder and, when video is a file name and
+        ffmpeg is available, encodes them into it. Returns the video path,
+        or the list of frame paths without a video.
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        log.save(folder)
+        ticks = len(log)
+        chunk = int(math.ceil(ticks / float(self.workers * 4))) or 1
+        with ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self.route_file, self.is_loop, self.view_x,
+                          self.figsize, self.dpi)) as pool:
+            chunks = [range(i, min(i + chunk, ticks))
+                      for i in range(0, ticks, chunk)]
+            list(pool.map(_render_frames, [folder] * len(chunks), chunks))
+
+        frames = [os.path.join(folder, self.FRAME % i) for i in range(ticks)]
+        if video is None or shutil.which('ffmpeg') is None:
+            return frames
+        subprocess.check_call(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-framerate', str(fps),
+             '-i', os.path.join(folder, self.FRAME), '-pix_fmt', 'yuv420p',
+             video])
+        return video
+
+
+def main():
+    import tempfile
+    from fleet import Fleet
+    from map import Route
+    from simulator import Simulator
+    print("Test FrameExporter class")
+    route = Route()
+    route.read("highway_map.csv")
+    sim = Simulator(route)
+    sim.add_car(s=0, lane=1, v=20)
+    rng = np.random.RandomState(0)
+    fleet = sim.add_fleet(Fleet(route, 30))
+    fleet.v[:] = rng.uniform(15, 25, 30)
+    fleet.move_to_route(rng.uniform(0, 300, 30), rng.randint(0, 3, 30))
+
+    log = StateLog()
+    start = time.time()
+    for _ in range(200):
+        sim.step()
+    plain = time.time() - start
+    start = time.time()
+    for _ in range(200):
+        sim.step()
+        log.record_simulator(sim)
+    print("200 ticks: %.1f ms without log, %.1f ms with log" %
+          (plain * 1e3, (time.time() - start) * 1e3))
+
+    folder = tempfile.mkdtemp()
+    start = time.time()
+    result = FrameExporter("highway_map.csv").export(
+        log, folder, video=os.path.join(folder, 'run.mp4'))
+    print("exported in %.1f s: %s" %
+          (time.time() - start,
+           result if isinstance(result, str) else
+           "%d frames in %s" % (len(result), folder)))
+
+
+if __name__ == "__main__":
+    main()